@@ -0,0 +1,48 @@
+# bench_panel_config.py
+# 面板配置读取与分页渲染的基准测试：python benchmarks/bench_panel_config.py
+
+import asyncio
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 在临时目录里运行，避免污染真实数据
+os.chdir(tempfile.mkdtemp(prefix="ivory_bench_"))
+
+from cogs import panel  # noqa: E402
+
+QA_COUNT = 500
+CHANNEL_ID = "1000"
+
+
+def setup_channel():
+    config = dict(panel.DEFAULT_TEMPLATE)
+    config["qa_list"] = [{"q": f"问题 {i}", "a": "回答内容 " * 40} for i in range(QA_COUNT)]
+    panel.db.set_config(CHANNEL_ID, config)
+
+
+async def main():
+    setup_channel()
+    number = 2000
+
+    get_cost = timeit.timeit(lambda: panel.db.get_config(CHANNEL_ID), number=number)
+    print(f"get_config          : {get_cost / number * 1e6:8.1f} µs/次 ({QA_COUNT} 条答疑)")
+
+    render_cost = timeit.timeit(lambda: panel.qa_menu(CHANNEL_ID, page=3), number=number // 10)
+    print(f"qa_menu 翻页渲染    : {render_cost / (number // 10) * 1e6:8.1f} µs/次")
+
+    def cold_pages():
+        panel.qa_pages.invalidate(CHANNEL_ID)
+        panel.qa_option_pages(CHANNEL_ID, panel.db.get_config(CHANNEL_ID))
+
+    build_cost = timeit.timeit(cold_pages, number=number // 10)
+    print(f"选项页重建（缓存失效）: {build_cost / (number // 10) * 1e6:8.1f} µs/次")
+
+    panel.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
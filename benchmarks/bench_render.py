@@ -0,0 +1,55 @@
+# bench_render.py
+# 答疑渲染的微基准：旧版每次正则解析 vs 共享缓存解析。python benchmarks/bench_render.py
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import render  # noqa: E402
+
+SAMPLE = (
+    "## 💡如何导入预设快速回复\n"
+    "1. 点开“扩展页面”图标，找到快速回复栏\n" * 20
+    + "![示意图](https://files.catbox.moe/ky692o.png)\n"
+    + "https://files.catbox.moe/cybaxk.png\n"
+    + "详见 [旅程Wiki](https://wiki.opizontas.org/books/api/page/cli)\n"
+)
+
+
+def legacy_panel(raw_text):
+    md_images = re.findall(r'!\[.*?\]\((https?://.*?\.(?:png|jpg|jpeg|gif|webp).*?)\)', raw_text, re.IGNORECASE)
+    clean_text = re.sub(r'!\[.*?\]\(https?://.*?\)', '', raw_text).strip() or "（查看图片）"
+    return clean_text, md_images
+
+
+def legacy_quick_qa(content):
+    images = re.findall(r'(https?://.*?\.(?:png|jpg|jpeg|gif|webp))', content, re.IGNORECASE)
+    clean_text = re.sub(r'!\[.*?\]\(https?://.*?\.(?:png|jpg|jpeg|gif|webp).*?\)', '', content, flags=re.IGNORECASE)
+    for img in images:
+        clean_text = clean_text.replace(img, "")
+    return clean_text.strip(), images
+
+
+def main():
+    number = 20000
+    cases = [
+        ("旧版 面板解析", lambda: legacy_panel(SAMPLE)),
+        ("旧版 快速答疑解析", lambda: legacy_quick_qa(SAMPLE)),
+        ("新版 面板冷缓存解析", lambda: render._parse(SAMPLE, bare_images=False)),
+        ("新版 快速答疑冷缓存解析", lambda: render._parse(SAMPLE)),
+        ("新版 热缓存解析", lambda: render.parse(SAMPLE)),
+        ("新版 热缓存 + 生成 Embed", lambda: render.build_embeds("Q", SAMPLE, 0xffc0cb, "（查看图片）", bare_images=False)),
+    ]
+    for name, fn in cases:
+        cost = timeit.timeit(fn, number=number)
+        print(f"{name:<24}: {cost / number * 1e6:8.2f} µs/次")
+    hits = render.cache.hits + render.panel_cache.hits
+    misses = render.cache.misses + render.panel_cache.misses
+    print(f"缓存命中: {hits} / 未命中: {misses}")
+
+
+if __name__ == "__main__":
+    main()
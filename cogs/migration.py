@@ -2,8 +2,64 @@ import discord
 from discord.ext import commands
 from discord.commands import SlashCommandGroup, Option
 import asyncio
+import os
 import time
 
+from utils import priority
+from utils.migrate import (
+    CANCELLED, DEFAULT_PRESET, DONE, PAUSED, PRESETS, RUNNING, STATUS_NAMES,
+    JobStore, MigrationEngine,
+)
+from utils.progress import ProgressReporter, format_duration
+from utils.ratelimit import TokenBucket
+from utils.roleplan import PlanError, RolePlan, parse_expression
+
+# ================= 配置区域 =================
+JOBS_FILE = "migration_jobs.json"
+# 所有迁移任务（不分服务器）共享的吞吐预算：每秒最多处理多少人
+MIGRATION_RATE = float(os.getenv("MIGRATION_RATE", "5"))
+# 检查点（追加新增进度）间隔（秒）
+CHECKPOINT_INTERVAL = 5
+# 进度消息最短编辑间隔（秒）
+PROGRESS_INTERVAL = float(os.getenv("MIGRATION_PROGRESS_INTERVAL", "3"))
+# ===========================================
+
+def member_role_ids(member):
+    # 不含 @everyone：它不能被增删，也不应参与条件运算
+    return frozenset(role.id for role in member.roles if not role.is_default())
+
+async def stream_members(guild, wants, skip, job):
+    """分页拉取服务器成员（不依赖成员缓存），边下载边筛选出需要处理的人。"""
+    job["scanned"] = 0
+    async for member in guild.fetch_members(limit=None):
+        job["scanned"] += 1
+        if member.id not in skip and wants(member):
+            yield member
+
+async def live_member(guild, member):
+    """成员的最新状态：缓存完整时直接读缓存（由网关实时更新），否则重新拉取一次。"""
+    if guild.chunked:
+        cached = guild.get_member(member.id)
+        if cached is not None:
+            return cached
+    return await guild.fetch_member(member.id)
+
+def resolve_role(guild):
+    """表达式里的身份组引用（id 或名称）-> 身份组 id。"""
+    def resolve(value):
+        if value.isdigit():
+            role = guild.get_role(int(value))
+        else:
+            role = discord.utils.get(guild.roles, name=value)
+        return role.id if role else None
+    return resolve
+
+def build_plan(guild, expression, add_ids, remove_ids):
+    for role_id in (*add_ids, *remove_ids):
+        if not guild.get_role(role_id):
+            raise PlanError(f"找不到身份组: {role_id}")
+    return RolePlan(parse_expression(expression, resolve_role(guild)), add_ids, remove_ids)
+
 def is_admin():
     def predicate(ctx):
         # 只要有管理身份组权限即可
@@ -13,102 +69,403 @@ def is_admin():
 class RoleMigration(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.store = JobStore(JOBS_FILE)
+        self.budget = TokenBucket(MIGRATION_RATE, MIGRATION_RATE)
+        self.engines = {}   # job_id -> 正在运行的 MigrationEngine
+        self.tasks = set()  # 持有任务协程的引用，避免运行中被回收
+        self.resumed = False
+
+    def cog_unload(self):
+        # 停止运行中的任务但保持“运行中”状态，下次启动时自动续跑
+        for engine in self.engines.values():
+            engine.stop()
+        self.store.save()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.resumed:
+            return
+        self.resumed = True
+        for job in list(self.store.jobs.values()):
+            if job["status"] == RUNNING:
+                print(f"🔁 续跑迁移任务 #{job['id']}")
+                self.start_job(job)
 
     migration_group = SlashCommandGroup("身份组管理", "批量操作身份组")
 
-    @migration_group.command(name="迁移", description="[管理员] 稳重迁移：逐个将源身份组人员赋予目标身份组")
+    # ---------- 任务执行 ----------
+
+    def start_job(self, job):
+        if job["id"] in self.engines:
+            return
+        task = asyncio.create_task(self.run_job(job))
+        self.tasks.add(task)
+        task.add_done_callback(self._job_done)
+
+    def _job_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️ 迁移任务异常退出: {task.exception()!r}")
+
+    async def announce_job(self, ctx, embed_for, **fields):
+        """先创建任务拿到真实编号，再发送启动消息；消息发送失败时取消该任务。"""
+        job = self.store.create(**fields)
+        try:
+            interaction = await ctx.respond(embed=embed_for(job["id"]))
+            msg = await interaction.original_response()
+        except Exception:
+            job["status"] = CANCELLED
+            self.store.save()
+            raise
+        job["message_id"] = msg.id
+        self.store.save()
+        self.start_job(job)
+
+    def prepare_job(self, job, guild):
+        """按任务类型返回 (是否需要处理该成员, 处理函数)。"""
+        reason = f"批量迁移: {job['author']}"
+
+        if job.get("kind") == "plan":
+            # 集合运算：按成员的最新身份组算出最终集合，一次编辑完成全部增删。
+            # 流式模式下排队中的成员快照可能已过去几分钟，直接用它会撤销这期间别人做的改动
+            plan = build_plan(guild, job["expression"], job["add_role_ids"], job["remove_role_ids"])
+
+            def wants(member):
+                return plan.final_roles(member_role_ids(member)) is not None
+
+            async def apply(member):
+                member = await live_member(guild, member)
+                final = plan.final_roles(member_role_ids(member))
+                if final is not None:
+                    await member.edit(roles=[discord.Object(id=role_id) for role_id in final], reason=reason)
+
+            return wants, apply
+
+        source_role = guild.get_role(job["source_role_id"])
+        target_role = guild.get_role(job["target_role_id"])
+        if not source_role or not target_role:
+            raise PlanError("身份组已不存在")
+
+        def wants(member):
+            return member.get_role(source_role.id) is not None and member.get_role(target_role.id) is None
+
+        async def apply(member):
+            await member.add_roles(target_role, reason=reason)
+
+        return wants, apply
+
+    async def run_job(self, job):
+        job_id = job["id"]
+        guild = self.bot.get_guild(job["guild_id"])
+        try:
+            if not guild:
+                raise PlanError("服务器已不存在")
+            wants, apply = self.prepare_job(job, guild)
+        except PlanError as e:
+            job["status"] = CANCELLED
+            job["error"] = str(e)
+            self.store.save()
+            return
+
+        # 2. 筛选名单：跳过不需要改动的人，以及检查点里已处理过的人
+        skip = set(job["processed"]) | set(job["failed"])
+        if job.get("streaming"):
+            # 流式模式：总人数未知，进度按累计人数展示
+            members_to_process = stream_members(guild, wants, skip, job)
+            job["total"] = None
+        else:
+            members_to_process = [m for m in guild.members if m.id not in skip and wants(m)]
+            job["total"] = len(skip) + len(members_to_process)
+        preset = PRESETS[job["mode"]]
+        channel = self.bot.get_channel(job["channel_id"])
+        msg = channel.get_partial_message(job["message_id"]) if channel and job.get("message_id") else None
+        last_checkpoint = time.monotonic()
+        elapsed_before = job.get("elapsed", 0)
+
+        async def process(member):
+            try:
+                await apply(member)
+            except discord.Forbidden:
+                job["failed"].append(member.id)
+                print(f"权限不足无法操作: {member.name}")
+                raise
+            except Exception:
+                job["failed"].append(member.id)
+                raise
+            job["processed"].append(member.id)
+
+        # 并发数按限速响应头自适应，所有任务共享同一个全局令牌桶
+        engine = MigrationEngine(process, preset=job["mode"], bucket=self.budget)
+        reporter = None
+        if msg:
+            reporter = ProgressReporter(
+                lambda embed: msg.edit(embed=embed),
+                lambda r: self.build_progress_embed(job, engine, r),
+                interval=PROGRESS_INTERVAL,
+                total=job["total"],
+                done=len(skip),
+            ).start()
+
+        async def report(engine):
+            nonlocal last_checkpoint
+            now = time.monotonic()
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                last_checkpoint = now
+                job["elapsed"] = elapsed_before + engine.elapsed
+                # 只追加新增的成员 id，不重写整个任务文件
+                self.store.checkpoint(job)
+
+            # 5. 更新 UI：只记录进度，由汇报器按时间间隔合并编辑
+            if reporter:
+                reporter.update(len(job["processed"]) + len(job["failed"]), extra=job.get("scanned"))
+
+        # 4. 开始处理：批量操作的请求优先级最低，交互响应进行中时会主动让路
+        self.engines[job_id] = engine
+        try:
+            with priority.api_priority(priority.BULK):
+                await engine.run(members_to_process, on_progress=report)
+        finally:
+            self.engines.pop(job_id, None)
+            job["elapsed"] = elapsed_before + engine.elapsed
+            if engine.finished:
+                job["status"] = DONE
+            elif engine.error is not None:
+                # 拉取成员失败：暂停任务，保留检查点，之后可以手动继续
+                job["status"] = PAUSED
+                job["error"] = str(engine.error)
+            self.store.save()
+
+        if not reporter:
+            return
+        if job["status"] != DONE:
+            # 暂停 / 取消：补发一次最新进度后停止
+            await reporter.finish()
+            return
+
+        # 7. 结束
+        final_embed = discord.Embed(title="✅ 迁移完成", color=0x2ecc71)
+        final_embed.description = f"**任务** #{job_id}\n{job['summary']}"
+        final_embed.add_field(name="最终结果", value=f"总耗时: {format_duration(job['elapsed'])}\n成功: {len(job['processed'])} 人\n失败: {len(job['failed'])} 人\n模式: {preset.name}（限速退避 {engine.backoffs} 次）", inline=False)
+        await reporter.finish(final_embed)
+
+    def build_progress_embed(self, job, engine, reporter):
+        preset = PRESETS[job["mode"]]
+        total = job["total"]
+        i = len(job["processed"]) + len(job["failed"])
+
+        embed = discord.Embed(title=f"{preset.icon} 迁移进行中...", color=0xe67e22)
+        embed.description = f"**任务** #{job['id']}\n{job['summary']}"
+        if total is None:
+            # 流式模式：总数未知，展示累计数量
+            embed.add_field(name="进度", value=f"已扫描 {job.get('scanned', 0)} 人 · 已处理 {i} 人 · 排队 {engine.fed - engine.done} 人", inline=False)
+            remaining = "拉取中..."
+        else:
+            percent = int((i / total) * 100) if total else 100
+
+            # 进度条绘制
+            bar_len = 15
+            filled = int(bar_len * i // total) if total else bar_len
+            bar = "█" * filled + "░" * (bar_len - filled)
+            embed.add_field(name="进度", value=f"`{bar}` {percent}%", inline=False)
+            remaining = total - i
+        embed.add_field(name="统计", value=f"✅ 成功: {len(job['processed'])}\n❌ 失败: {len(job['failed'])}\n👥 剩余: {remaining}", inline=True)
+        embed.add_field(name="耗时", value=format_duration(job.get("elapsed", 0) + engine.elapsed), inline=True)
+        embed.add_field(name="预计剩余", value=reporter.eta_text() if total is not None else "拉取完成后可估算", inline=True)
+        embed.add_field(name="速率", value=f"{reporter.rate:.1f} 人/秒 · 并发 {engine.limit} · 限速退避 {engine.backoffs} 次", inline=False)
+        return embed
+
+    def get_guild_job(self, ctx, job_id):
+        job = self.store.jobs.get(job_id.lstrip("#"))
+        if not job or job["guild_id"] != ctx.guild.id:
+            return None
+        return job
+
+    # ---------- 指令 ----------
+
+    @migration_group.command(name="迁移", description="[管理员] 将源身份组人员批量赋予目标身份组")
     @is_admin()
     async def migrate_roles(
-        self, 
+        self,
         ctx: discord.ApplicationContext,
         source_role: Option(discord.Role, "源身份组"),
-        target_role: Option(discord.Role, "目标身份组")
+        target_role: Option(discord.Role, "目标身份组"),
+        mode: Option(str, "迁移模式（稳重=逐个处理；标准/极速=并发处理并按限速自动调节）", choices=list(PRESETS), default=DEFAULT_PRESET),
+        streaming: Option(bool, "流式拉取成员：不依赖成员缓存，边下载边处理（适合超大服务器）", default=False)
     ):
         # 1. 基础检查
         if source_role.id == target_role.id:
             return await ctx.respond("❌ 源身份组和目标身份组不能相同。", ephemeral=True)
-        
+
         if target_role >= ctx.guild.me.top_role:
             return await ctx.respond("❌ 机器人的权限不足（Bot 必须位于目标身份组之上）。", ephemeral=True)
 
-        await ctx.defer() # 挂起响应，防止超时
+        # 成员缓存尚未拉取完整时自动改用流式模式
+        streaming = streaming or not ctx.guild.chunked
 
-        # 2. 筛选名单
-        # 依然先筛选出需要处理的人，避免无意义的 API 调用
-        members_to_process = [
-            m for m in source_role.members 
-            if target_role not in m.roles
-        ]
-        
-        total = len(members_to_process)
+        # 先粗略估算人数，避免为空名单创建任务（流式模式下边拉取边统计）
+        total = None if streaming else sum(1 for m in source_role.members if m.get_role(target_role.id) is None)
         if total == 0:
             return await ctx.respond(f"✅ 没有任何成员需要处理！\n({source_role.mention} 的所有成员都已经拥有 {target_role.mention} 了)", ephemeral=True)
 
         # 3. 初始化面板
-        start_time = time.time()
-        success_count = 0
-        fail_count = 0
-        
-        embed = discord.Embed(
-            title="🐢 稳重迁移模式启动",
-            description=f"**源**: {source_role.mention}\n**目标**: {target_role.mention}\n**待处理人数**: {total}",
-            color=0x3498db
+        preset = PRESETS[mode]
+
+        def embed_for(job_id):
+            embed = discord.Embed(
+                title=f"{preset.icon} {preset.name}迁移模式启动",
+                description=f"**任务** #{job_id}\n**源**: {source_role.mention}\n**目标**: {target_role.mention}\n**待处理人数**: {'边拉取边统计' if total is None else total}",
+                color=0x3498db
+            )
+            embed.add_field(name="进度", value="0/0 (0%)", inline=True)
+            embed.add_field(name="状态", value="正在处理...（进度会自动保存，重启后继续）", inline=False)
+            return embed
+
+        # 进度消息通过频道编辑，不受交互令牌 15 分钟有效期限制
+        await self.announce_job(
+            ctx,
+            embed_for,
+            guild_id=ctx.guild.id,
+            channel_id=ctx.channel.id,
+            message_id=None,
+            source_role_id=source_role.id,
+            target_role_id=target_role.id,
+            summary=f"**源**: {source_role.mention} -> **目标**: {target_role.mention}",
+            mode=mode,
+            streaming=streaming,
+            author=ctx.author.name,
         )
-        embed.add_field(name="进度", value="0/0 (0%)", inline=True)
-        embed.add_field(name="状态", value="正在逐个处理...", inline=False)
-        
-        # 获取消息对象
-        msg = await ctx.respond(embed=embed)
-
-        # 4. 开始循环处理 (串行)
-        for i, member in enumerate(members_to_process, 1):
-            try:
-                # 执行添加身份组
-                await member.add_roles(target_role, reason=f"批量迁移: {ctx.author.name}")
-                success_count += 1
-            except discord.Forbidden:
-                fail_count += 1
-                print(f"权限不足无法操作: {member.name}")
-            except Exception as e:
-                fail_count += 1
-                print(f"操作 {member.name} 失败: {e}")
-
-            # 5. 更新 UI (策略：每处理5个人，或者最后一个人时更新一次)
-            # 这样可以避免 "已在短时间内编辑该消息太多次" 的限制
-            if i % 5 == 0 or i == total:
-                elapsed = int(time.time() - start_time)
-                percent = int((i / total) * 100)
-                
-                # 进度条绘制
-                bar_len = 15
-                filled = int(bar_len * i // total)
-                bar = "█" * filled + "░" * (bar_len - filled)
-                
-                new_embed = discord.Embed(title="🐢 迁移进行中...", color=0xe67e22)
-                new_embed.description = f"**源**: {source_role.mention} -> **目标**: {target_role.mention}"
-                new_embed.add_field(name="进度", value=f"`{bar}` {percent}%", inline=False)
-                new_embed.add_field(name="统计", value=f"✅ 成功: {success_count}\n❌ 失败: {fail_count}\n👥 剩余: {total - i}", inline=True)
-                new_embed.add_field(name="耗时", value=f"{elapsed}秒", inline=True)
-                
-                try:
-                    await msg.edit(embed=new_embed)
-                except:
-                    pass # 如果更新失败（比如网络波动），不影响主流程继续
-
-            # 6. 安全延时 (稳重模式核心)
-            # 暂停 0.5 秒，防止触发 API 速率限制
-            await asyncio.sleep(0.5)
 
-        # 7. 结束
-        total_time = int(time.time() - start_time)
-        final_embed = discord.Embed(title="✅ 迁移完成", color=0x2ecc71)
-        final_embed.description = f"**源**: {source_role.mention} -> **目标**: {target_role.mention}"
-        final_embed.add_field(name="最终结果", value=f"总耗时: {total_time}秒\n成功: {success_count} 人\n失败: {fail_count} 人", inline=False)
-        
-        await msg.edit(embed=final_embed)
+    @migration_group.command(name="集合运算", description="[管理员] 按条件表达式批量增删身份组，每人只编辑一次")
+    @is_admin()
+    async def plan_roles(
+        self,
+        ctx: discord.ApplicationContext,
+        expression: Option(str, "条件，如 (@A | @B) - @C：| 并集，& 交集，- 差集"),
+        add_role: Option(discord.Role, "符合条件的成员获得此身份组", required=False, default=None),
+        remove_role: Option(discord.Role, "符合条件的成员失去此身份组", required=False, default=None),
+        execute: Option(bool, "立即执行（默认只预演，显示人数和预计耗时）", default=False),
+        mode: Option(str, "迁移模式", choices=list(PRESETS), default=DEFAULT_PRESET),
+        streaming: Option(bool, "流式拉取成员（适合超大服务器，预演不可用）", default=False)
+    ):
+        if not add_role and not remove_role:
+            return await ctx.respond("❌ 请至少指定一个要添加或移除的身份组。", ephemeral=True)
+        for role in (add_role, remove_role):
+            if role and role >= ctx.guild.me.top_role:
+                return await ctx.respond(f"❌ 机器人的权限不足（Bot 必须位于 {role.mention} 之上）。", ephemeral=True)
+
+        add_ids = [add_role.id] if add_role else []
+        remove_ids = [remove_role.id] if remove_role else []
+        try:
+            plan = build_plan(ctx.guild, expression, add_ids, remove_ids)
+        except PlanError as e:
+            return await ctx.respond(f"❌ 条件表达式有误：{e}", ephemeral=True)
+
+        actions = []
+        if add_role:
+            actions.append(f"+{add_role.mention}")
+        if remove_role:
+            actions.append(f"-{remove_role.mention}")
+        summary = f"**条件**: {plan.selector}\n**操作**: {' '.join(actions)}"
+        streaming = streaming or not ctx.guild.chunked
+        preset = PRESETS[mode]
+
+        if not execute:
+            if streaming:
+                return await ctx.respond("⚠️ 成员缓存不完整（或选择了流式模式），无法预演；确认无误后可直接执行。", ephemeral=True)
+            stats = plan.dry_run(member_role_ids(m) for m in ctx.guild.members)
+            rate = min(preset.expected_rate, MIGRATION_RATE)
+            embed = discord.Embed(title="🧮 预演结果（未执行）", description=summary, color=0x3498db)
+            embed.add_field(name="符合条件", value=f"{stats['matched']} 人", inline=True)
+            embed.add_field(name="需要改动", value=f"{stats['changed']} 人（每人 1 次编辑）", inline=True)
+            embed.add_field(name="身份组变动", value=f"新增 {stats['added']} 次 · 移除 {stats['removed']} 次", inline=True)
+            embed.add_field(name="预计耗时", value=f"约 {int(stats['changed'] / rate)} 秒（{preset.name}模式，约 {rate:.1f} 人/秒）", inline=False)
+            return await ctx.respond(embed=embed, ephemeral=True)
+
+        def embed_for(job_id):
+            embed = discord.Embed(
+                title=f"{preset.icon} {preset.name}模式启动",
+                description=f"**任务** #{job_id}\n{summary}",
+                color=0x3498db
+            )
+            embed.add_field(name="状态", value="正在处理...（进度会自动保存，重启后继续）", inline=False)
+            return embed
+
+        await self.announce_job(
+            ctx,
+            embed_for,
+            kind="plan",
+            guild_id=ctx.guild.id,
+            channel_id=ctx.channel.id,
+            message_id=None,
+            expression=str(plan.selector),
+            add_role_ids=add_ids,
+            remove_role_ids=remove_ids,
+            summary=summary,
+            mode=mode,
+            streaming=streaming,
+            author=ctx.author.name,
+        )
+
+    @migration_group.command(name="任务列表", description="[管理员] 查看本服务器的迁移任务")
+    @is_admin()
+    async def list_jobs(self, ctx):
+        jobs = [j for j in self.store.jobs.values() if j["guild_id"] == ctx.guild.id]
+        if not jobs:
+            return await ctx.respond("📭 本服务器还没有迁移任务。", ephemeral=True)
+
+        embed = discord.Embed(title="📋 迁移任务", color=0x3498db)
+        for job in sorted(jobs, key=lambda j: j["created"], reverse=True)[:10]:
+            done = len(job["processed"]) + len(job["failed"])
+            embed.add_field(
+                name=f"#{job['id']} · {STATUS_NAMES[job['status']]} · {job['mode']}",
+                value=(
+                    f"{job['summary']}\n"
+                    f"进度 {done}/{job.get('total') or '?'} · 失败 {len(job['failed'])} · 发起人 {job['author']}"
+                ),
+                inline=False,
+            )
+        await ctx.respond(embed=embed, ephemeral=True)
+
+    @migration_group.command(name="暂停任务", description="[管理员] 暂停一个迁移任务")
+    @is_admin()
+    async def pause_job(self, ctx, job_id: Option(str, "任务编号")):
+        job = self.get_guild_job(ctx, job_id)
+        if not job or job["status"] != RUNNING:
+            return await ctx.respond("❌ 找不到运行中的该任务。", ephemeral=True)
+        job["status"] = PAUSED
+        engine = self.engines.get(job["id"])
+        if engine:
+            engine.stop()
+        self.store.save()
+        await ctx.respond(f"⏸️ 任务 #{job['id']} 已暂停。", ephemeral=True)
+
+    @migration_group.command(name="继续任务", description="[管理员] 继续一个已暂停的迁移任务")
+    @is_admin()
+    async def resume_job(self, ctx, job_id: Option(str, "任务编号")):
+        job = self.get_guild_job(ctx, job_id)
+        if not job or job["status"] != PAUSED:
+            return await ctx.respond("❌ 找不到已暂停的该任务。", ephemeral=True)
+        if job["id"] in self.engines:
+            return await ctx.respond("⏳ 该任务正在停止中，请稍后再试。", ephemeral=True)
+        job["status"] = RUNNING
+        self.store.save()
+        self.start_job(job)
+        await ctx.respond(f"▶️ 任务 #{job['id']} 已继续。", ephemeral=True)
+
+    @migration_group.command(name="取消任务", description="[管理员] 取消一个迁移任务")
+    @is_admin()
+    async def cancel_job(self, ctx, job_id: Option(str, "任务编号")):
+        job = self.get_guild_job(ctx, job_id)
+        if not job or job["status"] not in (RUNNING, PAUSED):
+            return await ctx.respond("❌ 找不到未结束的该任务。", ephemeral=True)
+        job["status"] = CANCELLED
+        engine = self.engines.get(job["id"])
+        if engine:
+            engine.stop()
+        self.store.save()
+        await ctx.respond(f"🛑 任务 #{job['id']} 已取消。", ephemeral=True)
 
-    @migrate_roles.error
-    async def error_handler(self, ctx, error):
+    async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.CheckFailure):
             await ctx.respond("🚫 你没有权限管理身份组。", ephemeral=True)
         else:
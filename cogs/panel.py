@@ -6,14 +6,60 @@ from discord.commands import SlashCommandGroup, Option
 import json
 import os
 import asyncio
-import re
 import random
+import secrets
 import copy
 import io
+import atexit
+import time
+from collections import deque
+
+from utils.storage import open_storage
+from utils.persistence import WriteBehindWriter
+from utils.snapshot import ConfigSnapshot, thaw
+from utils.refresh import RefreshScheduler, CoalescingRunner, RefreshWorkerPool
+from utils.ratelimit import THROTTLE_MESSAGE, TokenBucket, component_limiter, limiters
+from utils import components, priority, render
+from utils.search import fulltext
+from utils.progress import ProgressReporter, print_progress
+from utils.metrics import interaction_latency, timed
 
 DATA_FILE = "data.json"
+DB_FILE = "data.db"
+# 存储后端：sqlite（默认，增量写入）或 json（旧版整份重写）
+STORAGE_BACKEND = os.getenv("PANEL_STORAGE", "sqlite")
+# 后台合并落盘的间隔（秒）与是否强制刷盘
+FLUSH_INTERVAL = float(os.getenv("PANEL_FLUSH_INTERVAL", "1.0"))
+DURABLE_WRITES = os.getenv("PANEL_DURABLE", "0") == "1"
 SUPER_ADMIN_ID = 1353777207042113576
-PAGE_SIZE = 25
+# 频道安静多少秒后刷新面板；持续有消息时最多等待多少秒
+REFRESH_DELAY = 4
+REFRESH_MAX_WAIT = 30
+# 原地编辑模式：面板仍在最新的这么多条消息之内时直接编辑，否则重发
+STICKY_WINDOW = 3
+# 全局刷新工作池：同时刷新的频道数，以及每秒/突发允许的刷新次数
+REFRESH_CONCURRENCY = int(os.getenv("PANEL_REFRESH_CONCURRENCY", "4"))
+REFRESH_RATE = float(os.getenv("PANEL_REFRESH_RATE", "2"))
+REFRESH_BURST = int(os.getenv("PANEL_REFRESH_BURST", "5"))
+REFRESH_MODES = {"置底重发": "bump", "原地编辑": "sticky"}
+# 面板消息索引：一次性回填时每个频道扫描的历史条数，以及索引保留上限
+BACKFILL_HISTORY_LIMIT = 1000
+PANEL_INDEX_LIMIT = 100
+# 订阅按钮：同一用户在此时间内重复点击直接回复，不再调用 API（秒）
+SUB_DEDUP_WINDOW = 10
+SUB_RECENT_LIMIT = 10000
+# 组件限流：(每秒补充令牌数, 桶容量)，按 (用户, 频道) 计
+THROTTLE_LIMITS = {
+    "ivory_qa_btn": (0.5, 3),
+    "ivory_sub_btn": (0.2, 2),
+    "面板答疑": (0.5, 3),
+}
+# 启动时索引回填 / 面板核对的进度输出间隔（秒）
+BACKFILL_PROGRESS_INTERVAL = 10
+# 启动核对：同时核对的频道数，以及整轮核对的时间预算（秒），超时未核对的频道留待下次触发刷新
+RECONCILE_CONCURRENCY = int(os.getenv("PANEL_RECONCILE_CONCURRENCY", "4"))
+RECONCILE_BUDGET = float(os.getenv("PANEL_RECONCILE_BUDGET", "120"))
+PANEL_CUSTOM_IDS = ("ivory_qa_btn", "ivory_sub_btn")
 
 DEFAULT_TEMPLATE = {
     "manager_id": 0,
@@ -24,42 +70,90 @@ DEFAULT_TEMPLATE = {
     "welcome": "> 欢迎使用自助答疑系统\n\n贴主可使用命令自行配置\n\n请点击下方按钮开始使用。",
     "downloads": "## ⬇️下载直达\n暂无链接",
     "qa_list": [],
-    "sub_role_ids": []
+    "sub_role_ids": [],
+    "refresh_mode": "bump"
 }
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, storage=None):
+        self.storage = storage or open_storage(STORAGE_BACKEND, DATA_FILE, DB_FILE, durable=DURABLE_WRITES)
         self.data = {"channels": {}}
-        self.load_data()
+        # 全局递增的配置版本号，每次写入都会生成新版本的快照
+        self.version = 0
+        # 配置变更监听器：listener(channel_id, 旧快照, 新快照)，删除时新快照为 None
+        self.listeners = []
+        fixed = self.load_data()
+        self.writer = WriteBehindWriter(self.storage, interval=FLUSH_INTERVAL, channels=self.data["channels"])
+        if fixed:
+            # 旧数据里的答疑条目补上 id 后整体写回（一次性迁移）
+            self.save_data()
+        # 进程退出时把积压的修改写完
+        atexit.register(self.close)
 
     def load_data(self):
-        if os.path.exists(DATA_FILE):
+        try:
+            channels = self.storage.load()
+        except Exception as e:
+            print(f"⚠️ 面板数据加载失败: {e}")
+            channels = {}
+            self.storage.commit({}, None)
+
+        if not isinstance(channels, dict):
+            channels = {}
+        fixed = set()
+        for cid, cfg in channels.items():
+            if isinstance(cfg, dict) and isinstance(cfg.get("qa_list"), list):
+                qa_list = with_qa_ids(cfg["qa_list"])
+                if qa_list is not cfg["qa_list"]:
+                    cfg["qa_list"] = qa_list
+                    fixed.add(str(cid))
+        self.data["channels"] = {
+            str(cid): self._snapshot(cfg) for cid, cfg in channels.items() if isinstance(cfg, dict)
+        }
+        return fixed
+
+    def _snapshot(self, config):
+        self.version += 1
+        return ConfigSnapshot(config, self.version)
+
+    def _notify(self, channel_id, old, new):
+        for listener in self.listeners:
             try:
-                with open(DATA_FILE, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-            except:
-                self.save_data()
-        else:
-            self.save_data()
+                listener(channel_id, old, new)
+            except Exception as e:
+                print(f"⚠️ 配置变更监听器出错: {e}")
+
+    def save_data(self, changed=None):
+        # 只标脏，由后台线程合并落盘；changed 为 None 表示全部重写
+        self.writer.mark(self.data["channels"], changed)
 
-        if not isinstance(self.data, dict):
-            self.data = {"channels": {}}
-        if "channels" not in self.data or not isinstance(self.data["channels"], dict):
-            self.data["channels"] = {}
+    def flush(self):
+        self.writer.flush()
 
-    def save_data(self):
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=4)
+    def close(self):
+        self.writer.close()
 
     def get_config(self, channel_id):
-        config = self.data["channels"].get(str(channel_id))
-        if config and "sub_role_ids" not in config:
-            config["sub_role_ids"] = []
-        return copy.deepcopy(config) if config else None
+        # 返回共享的只读快照，修改请使用 update_config / set_config
+        return self.data["channels"].get(str(channel_id))
 
     def set_config(self, channel_id, config):
-        self.data["channels"][str(channel_id)] = copy.deepcopy(config)
-        self.save_data()
+        old = self.data["channels"].get(str(channel_id))
+        qa_list = config.get("qa_list")
+        if qa_list and (old is None or qa_list is not old.get("qa_list")):
+            # 新增 / 导入的条目在这里统一分配 id
+            config = {**config, "qa_list": with_qa_ids(qa_list)}
+        snapshot = self._snapshot(config)
+        self.data["channels"][str(channel_id)] = snapshot
+        self.save_data({str(channel_id)})
+        self._notify(str(channel_id), old, snapshot)
+        return snapshot
+
+    def update_config(self, channel_id, **changes):
+        config = self.get_config(channel_id)
+        if config is None:
+            return None
+        return self.set_config(channel_id, config.evolve(**changes))
 
     def repair_isolation(self):
         channels = self.data.get("channels", {})
@@ -67,7 +161,7 @@ class DataManager:
         fixed_count = 0
 
         for cid, raw_config in channels.items():
-            original = raw_config if isinstance(raw_config, dict) else {}
+            original = thaw(raw_config) if isinstance(raw_config, ConfigSnapshot) else {}
 
             repaired = copy.deepcopy(DEFAULT_TEMPLATE)
             repaired.update(copy.deepcopy(original))
@@ -75,7 +169,7 @@ class DataManager:
             if not isinstance(repaired.get("qa_list"), list):
                 repaired["qa_list"] = []
             else:
-                repaired["qa_list"] = copy.deepcopy(repaired["qa_list"])
+                repaired["qa_list"] = with_qa_ids(copy.deepcopy(repaired["qa_list"]))
 
             if not isinstance(repaired.get("sub_role_ids"), list):
                 repaired["sub_role_ids"] = []
@@ -87,293 +181,224 @@ class DataManager:
             if old_json != new_json:
                 fixed_count += 1
 
-            normalized[str(cid)] = repaired
+            normalized[str(cid)] = self._snapshot(repaired)
 
         self.data["channels"] = normalized
         self.save_data()
+        for cid, snapshot in normalized.items():
+            self._notify(cid, channels.get(cid), snapshot)
         return {"total": len(normalized), "fixed": fixed_count}
     
     # 【新增】删除配置的方法
     def delete_config(self, channel_id):
         if str(channel_id) in self.data["channels"]:
-            del self.data["channels"][str(channel_id)]
-            self.save_data()
+            old = self.data["channels"].pop(str(channel_id))
+            self.save_data({str(channel_id)})
+            self._notify(str(channel_id), old, None)
             return True
         return False
 
     def is_authorized(self, channel_id):
         return str(channel_id) in self.data["channels"]
 
+# ================= 答疑条目 id =================
+# 每条答疑都有稳定的 id（条目的 "id" 字段），菜单、编辑和删除都按 id 定位：
+# 列表中间有条目被删除后，已经打开的菜单不会指向别的条目。
+
+def new_qa_id(taken):
+    while True:
+        entry_id = secrets.token_hex(4)
+        if entry_id not in taken:
+            taken.add(entry_id)
+            return entry_id
+
+def with_qa_ids(qa_list):
+    """给缺少 id（或 id 重复）的条目补上 id；全部正常时原样返回同一个对象。"""
+    ids = [item.get("id") for item in qa_list]
+    if all(ids) and len(set(ids)) == len(ids):
+        return qa_list
+    taken = set(filter(None, ids))
+    seen = set()
+    result = []
+    for item, entry_id in zip(qa_list, ids):
+        if not entry_id or entry_id in seen:
+            item = {**item, "id": new_qa_id(taken)}
+        seen.add(item["id"])
+        result.append(item)
+    return result
+
+# 频道 -> (qa_list, {条目 id: (位置, 条目)})；答疑列表未变时直接复用
+_qa_id_maps = {}
+
+def find_qa(channel_id, config, entry_id):
+    """按 id 查找条目，返回 (位置, 条目)；不存在时返回 (None, None)。"""
+    if not config:
+        return None, None
+    qa_list = config.get("qa_list", ())
+    cached = _qa_id_maps.get(str(channel_id))
+    if cached is None or cached[0] is not qa_list:
+        cached = (qa_list, {item.get("id"): (pos, item) for pos, item in enumerate(qa_list)})
+        _qa_id_maps[str(channel_id)] = cached
+    return cached[1].get(entry_id, (None, None))
+
 db = DataManager()
 
+def build_qa_embeds(config, qa):
+    return render.build_embeds(
+        f"Q: {qa.get('q', '未命名问题')}",
+        qa.get("a", ""),
+        config.get("color", 0xffc0cb),
+        placeholder="（查看图片）",
+        bare_images=False,
+    )
+
+# ================= 订阅身份组 =================
+# 频道 -> (sub_role_ids, 解析好的 Role 列表)；配置里的 sub_role_ids 元组未变时直接复用
+_sub_role_cache = {}
+# (频道, 用户) -> 最近一次订阅成功的时间；正在处理中的点击
+_sub_recent = {}
+_sub_inflight = set()
+sub_stats = {"clicks": 0, "deduped": 0, "edits": 0}
+
+def resolve_sub_roles(guild, channel_id, role_ids):
+    cached = _sub_role_cache.get(channel_id)
+    if cached is not None and cached[0] is role_ids:
+        return cached[1]
+    roles = [role for role in map(guild.get_role, role_ids) if role is not None]
+    _sub_role_cache[channel_id] = (role_ids, roles)
+    return roles
+
+def remember_subscription(key):
+    now = time.monotonic()
+    # 先删再插，保证字典按最近订阅时间排序
+    _sub_recent.pop(key, None)
+    _sub_recent[key] = now
+    if len(_sub_recent) > SUB_RECENT_LIMIT:
+        # 记录过多时清理过期的去重记录；仍然超限（短时间内点击的人太多）就只保留最新的一半
+        cutoff = now - SUB_DEDUP_WINDOW
+        for k in [k for k, t in _sub_recent.items() if t < cutoff]:
+            del _sub_recent[k]
+        if len(_sub_recent) > SUB_RECENT_LIMIT:
+            for k in list(_sub_recent)[:len(_sub_recent) // 2]:
+                del _sub_recent[k]
+
+qa_btn_limiter = component_limiter("ivory_qa_btn", *THROTTLE_LIMITS["ivory_qa_btn"])
+sub_btn_limiter = component_limiter("ivory_sub_btn", *THROTTLE_LIMITS["ivory_sub_btn"])
+panel_menu_limiter = component_limiter("面板答疑", *THROTTLE_LIMITS["面板答疑"])
+
 # ================= UI Views (主面板与展示) =================
 class MainPanelView(discord.ui.View):
     def __init__(self, channel_id_str):
         super().__init__(timeout=None)
         self.channel_id_str = channel_id_str
 
+    # 数据都在内存里：一次 send_message 直接响应，不再 defer + followup
     @discord.ui.button(label="🗳️ 自助答疑", style=discord.ButtonStyle.primary, custom_id="ivory_qa_btn", row=0)
     async def qa_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        view = QADropdownView(str(interaction.channel_id))
-        config = db.get_config(str(interaction.channel_id))
-        if not config or not config["qa_list"]:
-             await interaction.followup.send("暂无自助答疑内容。", ephemeral=True)
-             return
-        await interaction.followup.send(view.page_text(), view=view, ephemeral=True)
+        with timed("面板·自助答疑"):
+            if not qa_btn_limiter.allow((interaction.user.id, interaction.channel_id)):
+                return await interaction.response.send_message(THROTTLE_MESSAGE, ephemeral=True)
+            config = db.get_config(str(interaction.channel_id))
+            if not config or not config["qa_list"]:
+                return await interaction.response.send_message("暂无自助答疑内容。", ephemeral=True)
+            content, view = qa_menu(interaction.channel_id)
+            await interaction.response.send_message(content, view=view, ephemeral=True)
 
     @discord.ui.button(label="🔔 订阅更新", style=discord.ButtonStyle.success, custom_id="ivory_sub_btn", row=0)
     async def sub_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
+        with timed("面板·订阅更新") as timer:
+            await self._subscribe(interaction, timer)
+
+    async def _subscribe(self, interaction, timer):
+        if not sub_btn_limiter.allow((interaction.user.id, interaction.channel_id)):
+            return await interaction.response.send_message(THROTTLE_MESSAGE, ephemeral=True)
         config = db.get_config(str(interaction.channel_id))
         if not config:
-            return await interaction.followup.send("❌ 配置缺失或频道未授权。", ephemeral=True)
+            return await interaction.response.send_message("❌ 配置缺失或频道未授权。", ephemeral=True)
 
         role_ids = config.get("sub_role_ids", [])
         if not role_ids:
-            return await interaction.followup.send("⚠️ 本频道尚未配置订阅身份组，请联系负责人设置。", ephemeral=True)
+            return await interaction.response.send_message("⚠️ 本频道尚未配置订阅身份组，请联系负责人设置。", ephemeral=True)
 
         guild = interaction.guild
         member = interaction.user
-        
-        added_roles = []
-        already_has = True
-
-        for rid in role_ids:
-            role = guild.get_role(rid)
-            if role:
-                if role not in member.roles:
-                    try:
-                        await member.add_roles(role, reason="自助面板订阅")
-                        added_roles.append(role.name)
-                        already_has = False
-                    except discord.Forbidden:
-                        return await interaction.followup.send(f"❌ 无法分配身份组 `{role.name}`，Bot 权限不足。", ephemeral=True)
-        
-        if already_has:
-            await interaction.followup.send("✅ 您已经订阅过了（已拥有所有相关身份组）。", ephemeral=True)
-        else:
-            roles_str = "`, `".join(added_roles)
-            await interaction.followup.send(f"✅ 订阅成功！已为您添加：`{roles_str}`", ephemeral=True)
-
-class QADropdownView(discord.ui.View):
-    def __init__(self, channel_id_str, page=0):
-        super().__init__(timeout=180)
-        self.channel_id_str = channel_id_str
-        self.page = max(0, page)
-        self.refresh_items()
-
-    def get_qa_list(self):
-        config = db.get_config(self.channel_id_str)
-        if not config:
-            return []
-        return config.get("qa_list", [])
-
-    def total_pages(self):
-        qa_list = self.get_qa_list()
-        return max(1, (len(qa_list) + PAGE_SIZE - 1) // PAGE_SIZE)
-
-    def page_text(self):
-        return f"请选择您遇到的问题（第 {self.page + 1}/{self.total_pages()} 页）："
-
-    def get_page_slice(self):
-        qa_list = self.get_qa_list()
-        total = max(1, (len(qa_list) + PAGE_SIZE - 1) // PAGE_SIZE)
-        self.page = min(self.page, total - 1)
-
-        start = self.page * PAGE_SIZE
-        end = start + PAGE_SIZE
-        return start, qa_list[start:end]
-
-    def refresh_items(self):
-        self.clear_items()
-        self.add_item(QASelect(self))
-
-        prev_btn = PanelPageButton(-1)
-        next_btn = PanelPageButton(1)
-        prev_btn.disabled = self.page <= 0
-        next_btn.disabled = self.page >= self.total_pages() - 1
-        self.add_item(prev_btn)
-        self.add_item(next_btn)
-
-
-class PanelPageButton(discord.ui.Button):
-    def __init__(self, step):
-        self.step = step
-        label = "⬅️ 上一页" if step < 0 else "下一页 ➡️"
-        super().__init__(label=label, style=discord.ButtonStyle.secondary, row=1)
-
-    async def callback(self, interaction: discord.Interaction):
-        view = self.view
-        if not isinstance(view, QADropdownView):
-            return await interaction.response.send_message("❌ 视图状态异常，请重新打开菜单。", ephemeral=True)
-
-        new_page = view.page + self.step
-        max_page = view.total_pages() - 1
-        new_page = max(0, min(new_page, max_page))
-        if new_page == view.page:
-            return await interaction.response.defer()
-
-        view.page = new_page
-        view.refresh_items()
-        await interaction.response.edit_message(content=view.page_text(), view=view)
-
-class QASelect(discord.ui.Select):
-    def __init__(self, parent_view: QADropdownView):
-        self.parent_view = parent_view
-        self.channel_id_str = parent_view.channel_id_str
-        start, page_items = parent_view.get_page_slice()
-
-        options = []
-        for offset, item in enumerate(page_items):
-            label = item["q"][:95]
-            options.append(discord.SelectOption(label=label, value=str(start + offset)))
-
-        if not options:
-            options.append(discord.SelectOption(label="暂无可用问题", value="-1", default=True))
-
-        super().__init__(
-            placeholder="🔍 点击这里选择问题...",
-            min_values=1,
-            max_values=1,
-            options=options,
-            disabled=(len(page_items) == 0),
-        )
-
-    async def callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-        picked = self.values[0]
-        if picked == "-1":
-            return
-
-        idx = int(picked)
-        config = db.get_config(self.channel_id_str)
-        if config and 0 <= idx < len(config["qa_list"]):
-            qa = config["qa_list"][idx]
-            raw_text = qa['a']
-            md_images = re.findall(r'!\[.*?\]\((https?://.*?\.(?:png|jpg|jpeg|gif|webp).*?)\)', raw_text, re.IGNORECASE)
-            clean_text = re.sub(r'!\[.*?\]\(https?://.*?\)', '', raw_text).strip() or "（查看图片）"
-            
-            embed = discord.Embed(title=f"Q: {qa['q']}", description=clean_text, color=config.get("color", 0xffc0cb))
-            if md_images: embed.set_image(url=md_images[0])
-            await interaction.followup.send(embed=embed, ephemeral=True)
-        else:
-            await interaction.followup.send("未找到该内容。", ephemeral=True)
-
-
-class PanelRightClickSelectView(discord.ui.View):
-    def __init__(self, cog_ref, target_message: discord.Message, page=0):
-        super().__init__(timeout=120)
-        self.cog_ref = cog_ref
-        self.target_message = target_message
-        self.page = max(0, page)
-        self.refresh_items()
-
-    def get_qa_list(self):
-        config = db.get_config(str(self.target_message.channel.id))
-        if not config:
-            return []
-        return config.get("qa_list", [])
-
-    def total_pages(self):
-        qa_list = self.get_qa_list()
-        return max(1, (len(qa_list) + PAGE_SIZE - 1) // PAGE_SIZE)
-
-    def page_text(self):
-        return f"请选择要回复的条目（第 {self.page + 1}/{self.total_pages()} 页）："
-
-    def get_page_slice(self):
-        qa_list = self.get_qa_list()
-        total = max(1, (len(qa_list) + PAGE_SIZE - 1) // PAGE_SIZE)
-        self.page = min(self.page, total - 1)
-
-        start = self.page * PAGE_SIZE
-        end = start + PAGE_SIZE
-        return start, qa_list[start:end]
-
-    def refresh_items(self):
-        self.clear_items()
-        self.add_item(PanelRightClickSelect(self))
-
-        prev_btn = PanelRightClickPageButton(-1)
-        next_btn = PanelRightClickPageButton(1)
-        prev_btn.disabled = self.page <= 0
-        next_btn.disabled = self.page >= self.total_pages() - 1
-        self.add_item(prev_btn)
-        self.add_item(next_btn)
-
-
-class PanelRightClickPageButton(discord.ui.Button):
-    def __init__(self, step):
-        self.step = step
-        label = "⬅️ 上一页" if step < 0 else "下一页 ➡️"
-        super().__init__(label=label, style=discord.ButtonStyle.secondary, row=1)
-
-    async def callback(self, interaction: discord.Interaction):
-        view = self.view
-        if not isinstance(view, PanelRightClickSelectView):
-            return await interaction.response.send_message("❌ 视图状态异常，请重新打开菜单。", ephemeral=True)
-
-        new_page = view.page + self.step
-        max_page = view.total_pages() - 1
-        new_page = max(0, min(new_page, max_page))
-        if new_page == view.page:
-            return await interaction.response.defer()
-
-        view.page = new_page
-        view.refresh_items()
-        await interaction.response.edit_message(content=view.page_text(), view=view)
-
-
-class PanelRightClickSelect(discord.ui.Select):
-    def __init__(self, parent_view: PanelRightClickSelectView):
-        self.parent_view = parent_view
-        self.cog_ref = parent_view.cog_ref
-        self.target_message = parent_view.target_message
-        start, page_items = parent_view.get_page_slice()
-
-        options = []
-        for offset, item in enumerate(page_items):
-            label = item.get("q", "")[:95] or f"未命名问题 {start + offset + 1}"
-            options.append(discord.SelectOption(label=label, value=str(start + offset)))
-
-        if not options:
-            options.append(discord.SelectOption(label="暂无可用条目", value="-1", default=True))
-
-        super().__init__(
-            placeholder="👇 请选择要回复的答疑内容...",
-            min_values=1,
-            max_values=1,
-            options=options,
-            disabled=(len(page_items) == 0),
-        )
-
-    async def callback(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
-
-        picked = self.values[0]
-        if picked == "-1":
-            return
-
-        config = db.get_config(str(self.target_message.channel.id))
-        if not config:
-            return await interaction.followup.send("❌ 该频道未授权自助面板。", ephemeral=True)
-
-        qa_list = config.get("qa_list", [])
-        idx = int(picked)
-        if not (0 <= idx < len(qa_list)):
-            return await interaction.followup.send("❌ 条目不存在或已被删除。", ephemeral=True)
-
-        qa = qa_list[idx]
-        embeds = self.cog_ref.build_qa_embeds(config, qa)
-
+        key = (interaction.channel_id, member.id)
+        sub_stats["clicks"] += 1
+
+        # 同一用户连续点击：上一次还在处理，或刚刚订阅成功（成员缓存可能还没更新）
+        if key in _sub_inflight:
+            sub_stats["deduped"] += 1
+            return await interaction.response.send_message("⏳ 正在处理您的订阅，请稍候…", ephemeral=True)
+        if time.monotonic() - _sub_recent.get(key, 0) < SUB_DEDUP_WINDOW:
+            sub_stats["deduped"] += 1
+            return await interaction.response.send_message("✅ 您已经订阅过了（已拥有所有相关身份组）。", ephemeral=True)
+
+        # 一次集合运算算出缺少的身份组
+        roles = resolve_sub_roles(guild, interaction.channel_id, role_ids)
+        held = {role.id for role in member.roles}
+        missing = [role for role in roles if role.id not in held]
+        if not missing:
+            return await interaction.response.send_message("✅ 您已经订阅过了（已拥有所有相关身份组）。", ephemeral=True)
+
+        _sub_inflight.add(key)
         try:
-            await self.target_message.reply(content=None, embeds=embeds, mention_author=True)
-            await interaction.followup.send(f"✅ 已回复：**{qa.get('q', '未知问题')}**", ephemeral=True)
+            # 非原子模式：所有身份组合并为一次成员编辑；只有这一步慢到快超时才会 defer
+            await components.within(interaction, member.add_roles(*missing, reason="自助面板订阅", atomic=False), timer)
+            sub_stats["edits"] += 1
+            remember_subscription(key)
         except discord.Forbidden:
-            await interaction.followup.send("❌ 无法回复该消息（可能缺少权限）。", ephemeral=True)
-        except Exception as e:
-            await interaction.followup.send(f"❌ 发送失败：{e}", ephemeral=True)
+            names = "`, `".join(role.name for role in missing)
+            return await components.respond(interaction, f"❌ 无法分配身份组 `{names}`，Bot 权限不足。")
+        except discord.HTTPException as e:
+            # 身份组可能已被删除，丢弃缓存，下次点击时重新解析
+            _sub_role_cache.pop(interaction.channel_id, None)
+            print(f"⚠️ 频道 {interaction.channel_id} 订阅失败: {e}")
+            return await components.respond(interaction, "❌ 订阅失败，请稍后再试或联系负责人。")
+        finally:
+            _sub_inflight.discard(key)
+
+        roles_str = "`, `".join(role.name for role in missing)
+        await components.respond(interaction, f"✅ 订阅成功！已为您添加：`{roles_str}`")
+
+# ================= 答疑菜单（无状态组件） =================
+# 状态全部编码在 custom_id 里，由 SelfPanel 注册的处理函数统一响应：
+#   ivp:qs:<频道>        面板“自助答疑”选择问题    ivp:qp:<频道>:<页>       翻页
+#   ivp:rs:<目标消息>    右键“面板答疑”选择条目    ivp:rp:<目标消息>:<页>   翻页
+
+# 频道 -> 预先构建好的问题选项页；以 qa_list 元组本身作版本，只有答疑列表改动才重建
+qa_pages = components.PageCache()
+
+def qa_option_pages(channel_id, config):
+    def entries():
+        return [
+            (item.get("q", "")[:95] or f"未命名问题 {idx + 1}", item["id"])
+            for idx, item in enumerate(config.get("qa_list", ()))
+        ]
+    return qa_pages.get(str(channel_id), config.get("qa_list", ()), entries)
+
+def build_qa_menu(channel_id, page, select_id, page_id, placeholder, empty_label):
+    """返回 (实际页码, 总页数, 视图)；page_id(页码) 生成翻页按钮的 custom_id。"""
+    pages = qa_option_pages(channel_id, db.get_config(str(channel_id)) or DEFAULT_TEMPLATE)
+    page, view = components.paged_select(pages, page, select_id, page_id, placeholder, empty_label)
+    return page, len(pages), view
+
+def qa_menu(channel_id, page=0):
+    page, total, view = build_qa_menu(
+        channel_id, page,
+        components.custom_id("ivp:qs", channel_id),
+        lambda p: components.custom_id("ivp:qp", channel_id, p),
+        "🔍 点击这里选择问题...", "暂无可用问题",
+    )
+    return f"请选择您遇到的问题（第 {page + 1}/{total} 页）：", view
+
+def reply_menu(channel_id, message_id, page=0):
+    page, total, view = build_qa_menu(
+        channel_id, page,
+        components.custom_id("ivp:rs", message_id),
+        lambda p: components.custom_id("ivp:rp", message_id, p),
+        "👇 请选择要回复的答疑内容...", "暂无可用条目",
+    )
+    return f"请选择要回复的条目（第 {page + 1}/{total} 页）：", view
 
 # ================= 编辑功能组件 =================
 
@@ -391,28 +416,27 @@ class EditQASelect(discord.ui.Select):
         qa_list = config["qa_list"] if config else []
         
         options = []
-        for idx, item in enumerate(qa_list[:25]):
+        for item in qa_list[:25]:
             label = item["q"][:95]
-            options.append(discord.SelectOption(label=label, value=str(idx), emoji="📝"))
+            options.append(discord.SelectOption(label=label, value=item["id"], emoji="📝"))
             
         super().__init__(placeholder="👇 请选择要修改的答疑...", min_values=1, max_values=1, options=options)
 
     async def callback(self, interaction: discord.Interaction):
-        idx = int(self.values[0])
-        config = db.get_config(self.channel_id_str)
-        if config and 0 <= idx < len(config["qa_list"]):
-            item = config["qa_list"][idx]
-            modal = EditQAModal(self.channel_id_str, self.cog_ref, idx, item["q"], item["a"])
+        entry_id = self.values[0]
+        _, item = find_qa(self.channel_id_str, db.get_config(self.channel_id_str), entry_id)
+        if item is not None:
+            modal = EditQAModal(self.channel_id_str, self.cog_ref, entry_id, item["q"], item["a"])
             await interaction.response.send_modal(modal)
         else:
             await interaction.response.send_message("❌ 该条目似乎已被删除。", ephemeral=True)
 
 class EditQAModal(discord.ui.Modal):
-    def __init__(self, channel_id_str, cog_ref, idx, old_q, old_a):
+    def __init__(self, channel_id_str, cog_ref, entry_id, old_q, old_a):
         super().__init__(title="修改答疑条目")
         self.channel_id_str = channel_id_str
         self.cog_ref = cog_ref
-        self.idx = idx
+        self.entry_id = entry_id
         self.add_item(discord.ui.InputText(label="问题", value=old_q, placeholder="输入新的标题..."))
         self.add_item(discord.ui.InputText(label="回答", value=old_a, placeholder="输入新的内容...", style=discord.InputTextStyle.long))
 
@@ -421,9 +445,13 @@ class EditQAModal(discord.ui.Modal):
         if config:
             new_q = self.children[0].value
             new_a = self.children[1].value
-            if 0 <= self.idx < len(config["qa_list"]):
-                config["qa_list"][self.idx] = {"q": new_q, "a": new_a}
-                db.set_config(self.channel_id_str, config)
+            # 弹窗打开期间其他条目可能被增删，按 id 重新定位
+            pos, item = find_qa(self.channel_id_str, config, self.entry_id)
+            if item is not None:
+                qa_list = list(config["qa_list"])
+                render.invalidate(item.get("a"))
+                qa_list[pos] = {"id": self.entry_id, "q": new_q, "a": new_a}
+                db.update_config(self.channel_id_str, qa_list=qa_list)
                 await interaction.response.send_message(f"✅ 已成功修改问题：`{new_q}`", ephemeral=True)
                 await self.cog_ref.run_refresh_logic(interaction.channel)
             else:
@@ -440,8 +468,7 @@ class ConfigSubRoleView(discord.ui.View):
         role_ids = [r.id for r in roles]
         config = db.get_config(self.channel_id_str)
         if config:
-            config["sub_role_ids"] = role_ids
-            db.set_config(self.channel_id_str, config)
+            db.update_config(self.channel_id_str, sub_role_ids=role_ids)
             names = [r.name for r in roles]
             msg = f"✅ 已设置订阅身份组：`{', '.join(names)}`" if names else "✅ 已清空订阅身份组。"
             await interaction.response.send_message(msg, ephemeral=True)
@@ -457,8 +484,8 @@ class AddQAModal(discord.ui.Modal):
     async def callback(self, interaction: discord.Interaction):
         config = db.get_config(self.channel_id_str)
         if config:
-            config["qa_list"].append({"q": self.children[0].value, "a": self.children[1].value})
-            db.set_config(self.channel_id_str, config)
+            new_item = {"q": self.children[0].value, "a": self.children[1].value}
+            db.update_config(self.channel_id_str, qa_list=config["qa_list"] + (new_item,))
             await interaction.response.send_message(f"✅ 已添加", ephemeral=True)
             await self.cog_ref.run_refresh_logic(interaction.channel)
 
@@ -476,15 +503,17 @@ class EditProfileModal(discord.ui.Modal):
     async def callback(self, interaction: discord.Interaction):
         config = db.get_config(interaction.channel.id)
         if config:
-            config["title"] = self.children[0].value
-            config["author"] = self.children[1].value
-            config["version"] = self.children[2].value
             try:
                 color_int = int(self.children[3].value.replace("#", ""), 16)
             except:
                 color_int = 0xffc0cb
-            config["color"] = color_int
-            db.set_config(str(interaction.channel.id), config)
+            db.update_config(
+                str(interaction.channel.id),
+                title=self.children[0].value,
+                author=self.children[1].value,
+                version=self.children[2].value,
+                color=color_int,
+            )
             await interaction.response.send_message("✅ 外观信息已更新。", ephemeral=True)
             await self.cog_ref.run_refresh_logic(interaction.channel)
 
@@ -498,9 +527,11 @@ class EditContentModal(discord.ui.Modal):
     async def callback(self, interaction: discord.Interaction):
         config = db.get_config(str(interaction.channel.id))
         if config:
-            config["welcome"] = self.children[0].value
-            config["downloads"] = self.children[1].value
-            db.set_config(str(interaction.channel.id), config)
+            db.update_config(
+                str(interaction.channel.id),
+                welcome=self.children[0].value,
+                downloads=self.children[1].value,
+            )
             await interaction.response.send_message("✅ 正文内容已更新。", ephemeral=True)
             await self.cog_ref.run_refresh_logic(interaction.channel)
 
@@ -516,17 +547,19 @@ class DeleteQASelect(discord.ui.Select):
         config = db.get_config(channel_id_str)
         qa_list = config["qa_list"] if config else []
         options = []
-        for idx, item in enumerate(qa_list[:25]):
+        for item in qa_list[:25]:
             label = item["q"][:95]
-            options.append(discord.SelectOption(label=label, value=str(idx), emoji="🗑️"))
+            options.append(discord.SelectOption(label=label, value=item["id"], emoji="🗑️"))
         super().__init__(placeholder="选择要删除的问题...", min_values=1, max_values=1, options=options)
 
     async def callback(self, interaction: discord.Interaction):
-        idx = int(self.values[0])
         config = db.get_config(self.channel_id_str)
-        if config and 0 <= idx < len(config["qa_list"]):
-            removed = config["qa_list"].pop(idx)
-            db.set_config(self.channel_id_str, config)
+        pos, _ = find_qa(self.channel_id_str, config, self.values[0])
+        if pos is not None:
+            qa_list = list(config["qa_list"])
+            removed = qa_list.pop(pos)
+            render.invalidate(removed.get("a"))
+            db.update_config(self.channel_id_str, qa_list=qa_list)
             await interaction.response.send_message(f"✅ 已删除：{removed['q']}", ephemeral=True)
             await self.cog_ref.run_refresh_logic(interaction.channel)
         else:
@@ -536,135 +569,376 @@ class DeleteQASelect(discord.ui.Select):
 class SelfPanel(discord.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.scheduled_tasks = {}
-        self.refresh_locks = {}
+        self.refresh_scheduler = RefreshScheduler(self.run_refresh_logic, delay=REFRESH_DELAY, max_wait=REFRESH_MAX_WAIT)
+        self.refresh_runner = CoalescingRunner(self._refresh_panel)
+        self.refresh_pool = RefreshWorkerPool(
+            self._run_pooled_refresh,
+            concurrency=REFRESH_CONCURRENCY,
+            bucket=TokenBucket(REFRESH_RATE, REFRESH_BURST),
+        )
+        # 面板发出后频道里又出现了多少条消息（仅内存，重启后视为未知）
+        self.messages_since_panel = {}
+        self.refresh_stats = {"refreshes": 0, "api_calls": 0, "edits": 0}
+        self.backfill_started = False
+        self.reconcile_stats = None
+
+        # 全文检索：首次检索时加载所有频道的答疑，之后随配置变更增量更新
+        fulltext.register_source("panel", self._fulltext_all_docs)
+        db.listeners.append(self._on_config_changed)
+        components.register("ivp:qs", self.on_qa_select)
+        components.register("ivp:qp", self.on_qa_page)
+        components.register("ivp:rs", self.on_reply_select)
+        components.register("ivp:rp", self.on_reply_page)
         self.instance_id = random.randint(1000, 9999)
         print(f"🤖 Bot实例 [{self.instance_id}] 已启动！正在监听...")
 
-    async def run_refresh_logic(self, channel: discord.TextChannel):
-        cid = channel.id
+    def cog_unload(self):
+        if self._on_config_changed in db.listeners:
+            db.listeners.remove(self._on_config_changed)
+        for prefix in ("ivp:qs", "ivp:qp", "ivp:rs", "ivp:rp"):
+            components.unregister(prefix)
+        self.refresh_scheduler.stop()
+        self.refresh_pool.stop()
+        db.flush()
+
+    # ---------- 答疑菜单 ----------
+
+    async def on_qa_page(self, interaction, channel_id, page):
+        content, view = qa_menu(channel_id, int(page))
+        await interaction.response.edit_message(content=content, view=view)
+
+    async def on_reply_page(self, interaction, message_id, page):
+        content, view = reply_menu(interaction.channel_id, message_id, int(page))
+        await interaction.response.edit_message(content=content, view=view)
+
+    async def on_qa_select(self, interaction, channel_id):
+        with timed("面板·选择问题"):
+            picked = interaction.data["values"][0]
+            if picked == "-1":
+                return await interaction.response.defer()
+
+            config = db.get_config(channel_id)
+            _, qa = find_qa(channel_id, config, picked)
+            if qa is not None:
+                await interaction.response.send_message(embeds=build_qa_embeds(config, qa), ephemeral=True)
+            else:
+                await interaction.response.send_message("未找到该内容。", ephemeral=True)
 
-        print(f"🔍 实例 [{self.instance_id}] 正在尝试刷新频道 {cid}...")
+    async def on_reply_select(self, interaction, message_id):
+        with timed("面板答疑·回复") as timer:
+            picked = interaction.data["values"][0]
+            if picked == "-1":
+                return await interaction.response.defer()
 
-        if self.refresh_locks.get(cid, False):
-            print(f"🔒 实例 [{self.instance_id}] 发现频道 {cid} 被锁住了，跳过。")
-            return
+            config = db.get_config(str(interaction.channel_id))
+            if not config:
+                return await interaction.response.send_message("❌ 该频道未授权自助面板。", ephemeral=True)
 
-        self.refresh_locks[cid] = True
+            _, qa = find_qa(interaction.channel_id, config, picked)
+            if qa is None:
+                return await interaction.response.send_message("❌ 条目不存在或已被删除。", ephemeral=True)
 
-        try:
-            config = db.get_config(cid)
-            if not config: return
+            embeds = build_qa_embeds(config, qa)
+            target_message = interaction.channel.get_partial_message(int(message_id))
 
-            last_msg_id = config.get("last_panel_id")
-            deleted_success = False
+            try:
+                # 回复目标消息是唯一真正的网络操作，完成后用一次 send_message 确认
+                await components.within(interaction, target_message.reply(content=None, embeds=embeds, mention_author=True), timer)
+                await components.respond(interaction, f"✅ 已回复：**{qa.get('q', '未知问题')}**")
+            except discord.Forbidden:
+                await components.respond(interaction, "❌ 无法回复该消息（可能缺少权限）。")
+            except Exception as e:
+                await components.respond(interaction, f"❌ 发送失败：{e}")
+
+    async def run_refresh_logic(self, channel: discord.TextChannel):
+        # 交给全局工作池排队执行，同一频道排队中的请求会被合并
+        print(f"🔍 实例 [{self.instance_id}] 正在尝试刷新频道 {channel.id}...")
+        if not self.refresh_pool.submit(channel):
+            print(f"🔒 实例 [{self.instance_id}] 频道 {channel.id} 已在刷新队列中，已合并。")
+
+    @staticmethod
+    def _fulltext_docs(cid, config):
+        return [
+            (("panel", cid, qa.get("id")), qa.get("q", ""), qa.get("a", ""), {"channel_id": int(cid), "title": qa.get("q", "")})
+            for qa in config.get("qa_list", ())
+        ]
+
+    def _fulltext_all_docs(self):
+        for cid, config in db.data["channels"].items():
+            for doc_id, title, text, meta in self._fulltext_docs(cid, config):
+                yield ("panel", cid), doc_id, title, text, meta
+
+    def _on_config_changed(self, cid, old, new):
+        if new is None:
+            fulltext.replace_group(("panel", cid), [])
+            qa_pages.invalidate(cid)
+            _qa_id_maps.pop(cid, None)
+            return
+        # 只有答疑列表变化时才需要更新索引（刷新面板等操作不会触发）
+        if old is not None and old.get("qa_list") is new.get("qa_list"):
+            return
+        fulltext.replace_group(("panel", cid), self._fulltext_docs(cid, new))
 
-            if last_msg_id:
+    async def _run_pooled_refresh(self, channel: discord.TextChannel):
+        # 刷新发出的请求排在交互响应之后
+        with priority.api_priority(priority.REFRESH):
+            await self.refresh_runner.request(channel)
+
+    async def _refresh_panel(self, channel: discord.TextChannel):
+        cid = channel.id
+        config = db.get_config(cid)
+        if not config: return
+
+        panel_ids = list(config.get("panel_ids", ()))
+        last_msg_id = panel_ids[-1] if panel_ids else config.get("last_panel_id")
+        self.refresh_stats["refreshes"] += 1
+
+        # 原地编辑：面板还没被刷上去时，一次 edit 即可完成刷新
+        if last_msg_id and config.get("refresh_mode") == "sticky":
+            since = self.messages_since_panel.get(cid)
+            if since is None:
+                # 计数未知（如重启后）：先核对面板位置，而不是直接重发
+                since = await self.messages_after_panel(channel, last_msg_id)
+            if since is not None and since < STICKY_WINDOW:
                 try:
-                    old_msg = await channel.fetch_message(last_msg_id)
-                    await old_msg.delete()
-                    deleted_success = True
+                    self.refresh_stats["api_calls"] += 1
+                    await channel.get_partial_message(last_msg_id).edit(
+                        embed=self.build_panel_embed(config), view=MainPanelView(str(cid))
+                    )
+                    self.refresh_stats["edits"] += 1
+                    return
                 except discord.NotFound:
                     pass
                 except Exception as e:
-                    print(f"按ID删除旧面板失败: {e}")
-
-            if not deleted_success:
+                    print(f"原地编辑面板失败，改为重发: {e}")
+
+        # 按索引直接删除所有旧面板，无需扫描历史消息
+        if not panel_ids and last_msg_id:
+            panel_ids = [last_msg_id]
+        gone = await self.delete_panel_messages(channel, panel_ids)
+        remaining = [mid for mid in panel_ids if mid not in gone]
+
+        # --- 发送新面板 ---
+        view = MainPanelView(str(cid))
+        self.refresh_stats["api_calls"] += 1
+        new_msg = await channel.send(embed=self.build_panel_embed(config), view=view)
+        self.messages_since_panel[cid] = 0
+
+        panel_ids = (remaining + [new_msg.id])[-PANEL_INDEX_LIMIT:]
+        db.update_config(cid, last_panel_id=new_msg.id, panel_ids=panel_ids)
+
+    async def messages_after_panel(self, channel, panel_id):
+        """面板之后还有多少条消息；不在最近 STICKY_WINDOW 条内时返回 None。"""
+        if channel.last_message_id == panel_id:
+            count = 0
+        else:
+            count = None
+            try:
+                self.refresh_stats["api_calls"] += 1
+                recent = [msg.id async for msg in channel.history(limit=STICKY_WINDOW)]
+            except discord.HTTPException as e:
+                print(f"读取频道 {channel.id} 最近消息失败: {e}")
+                return None
+            if panel_id in recent:
+                count = recent.index(panel_id)
+        if count is not None:
+            self.messages_since_panel[channel.id] = count
+        return count
+
+    async def delete_panel_messages(self, channel, message_ids):
+        """按 ID 删除面板消息，返回已确认不存在的消息 ID 集合。"""
+        gone = set()
+        message_ids = list(message_ids)
+        if len(message_ids) > 1:
+            # 批量删除每次最多 100 条，且只能删除 14 天内的消息
+            for i in range(0, len(message_ids), 100):
+                chunk = message_ids[i:i + 100]
                 try:
-                    messages_to_delete = []
-                    async for message in channel.history(limit=100): # 妈妈把这里改成了 100
-                        if message.author.id != self.bot.user.id: continue
-
-                        is_panel_message = False
-                        # 判定逻辑保持不变
-                        if message.embeds and message.embeds[0].title == config["title"]:
-                            is_panel_message = True
-                        if not is_panel_message and message.components:
-                            for component in message.components:
-                                if isinstance(component, discord.ActionRow):
-                                    for child in component.children:
-                                        if hasattr(child, "custom_id") and child.custom_id in ["ivory_qa_btn", "ivory_sub_btn"]:
-                                            is_panel_message = True
-                                            break
-                                if is_panel_message: break
-
-                        if is_panel_message:
-                            messages_to_delete.append(message)
-
-                    if messages_to_delete:
-                        if len(messages_to_delete) == 1:
-                            await messages_to_delete[0].delete()
-                        else:
-                            await channel.delete_messages(messages_to_delete)
+                    self.refresh_stats["api_calls"] += 1
+                    if len(chunk) == 1:
+                        await channel.get_partial_message(chunk[0]).delete()
+                    else:
+                        await channel.delete_messages([channel.get_partial_message(mid) for mid in chunk])
+                    gone.update(chunk)
+                except discord.NotFound:
+                    if len(chunk) == 1:
+                        gone.update(chunk)
+                    # 批量删除只要有一条不存在就整体失败，其余消息交给下面逐条删除确认
                 except Exception as e:
-                    print(f"扫描删除旧面板异常: {e}")
-
-            # --- 发送新面板 ---
-            embed = discord.Embed(
-                title=config["title"],
-                description=f"作者：{config['author']} | 版本：{config['version']}\n\n{config['welcome']}\n\n---\n{config['downloads']}",
-                color=config["color"]
-            )
-            embed.set_footer(text=f"最后刷新时间")
-            embed.timestamp = discord.utils.utcnow()
-
-            view = MainPanelView(str(cid))
-            new_msg = await channel.send(embed=embed, view=view)
+                    print(f"批量删除旧面板失败，改为逐条删除: {e}")
+            message_ids = [mid for mid in message_ids if mid not in gone]
 
-            config["last_panel_id"] = new_msg.id
-            db.set_config(cid, config)
-
-        finally:
-            self.refresh_locks[cid] = False
+        for mid in message_ids:
+            try:
+                self.refresh_stats["api_calls"] += 1
+                await channel.get_partial_message(mid).delete()
+                gone.add(mid)
+            except discord.NotFound:
+                gone.add(mid)
+            except Exception as e:
+                print(f"按ID删除旧面板失败: {e}")
+        return gone
+
+    def is_panel_message(self, message, config):
+        if message.author.id != self.bot.user.id:
+            return False
+        # 判定方式 A: Embed 标题匹配
+        if message.embeds and message.embeds[0].title == config.get("title"):
+            return True
+        # 判定方式 B: 按钮 ID 匹配 (更稳健，防止标题已改)
+        for component in message.components:
+            if isinstance(component, discord.ActionRow):
+                for child in component.children:
+                    if getattr(child, "custom_id", None) in PANEL_CUSTOM_IDS:
+                        return True
+        return False
 
-    async def schedule_refresh(self, channel: discord.TextChannel):
-        cid = channel.id
-        if cid in self.scheduled_tasks:
-            task = self.scheduled_tasks[cid]
-            if not task.done(): task.cancel()
+    async def backfill_panel_index(self, channel):
+        """扫描历史消息，重建单个频道的面板消息索引。"""
+        config = db.get_config(channel.id)
+        if not config:
+            return 0
+        before = set(config.get("panel_ids", ()))
+        found = set()
+        async for message in channel.history(limit=BACKFILL_HISTORY_LIMIT):
+            if self.is_panel_message(message, config):
+                found.add(message.id)
+
+        # 扫描期间刷新可能已发出新面板、删除旧面板：合并到最新的配置上，而不是覆盖
+        config = db.get_config(channel.id)
+        if not config:
+            return 0
+        known = set(config.get("panel_ids", ()))
+        if config.get("last_panel_id"):
+            known.add(config["last_panel_id"])
+        panel_ids = sorted(known | (found - (before - known)))[-PANEL_INDEX_LIMIT:]
+        db.update_config(channel.id, panel_ids=panel_ids)
+        return len(panel_ids)
+
+    async def backfill_all_panel_indexes(self):
+        # 只处理还没有索引的频道（旧数据），已建立索引的频道不再扫描
+        todo = [cid for cid, config in db.data["channels"].items() if "panel_ids" not in config]
+        if not todo:
+            return
+        print(f"🗂️ 开始回填面板消息索引，共 {len(todo)} 个频道...")
+        done = 0
+        reporter = ProgressReporter(
+            print_progress,
+            lambda r: f"🗂️ 索引回填进度 {r.done}/{r.total} 个频道，预计剩余 {r.eta_text()}",
+            interval=BACKFILL_PROGRESS_INTERVAL,
+            total=len(todo),
+        ).start()
+        for i, cid in enumerate(todo, 1):
+            channel = self.bot.get_channel(int(cid))
+            if channel is not None:
+                try:
+                    await self.backfill_panel_index(channel)
+                    done += 1
+                except Exception as e:
+                    print(f"⚠️ 频道 {cid} 索引回填失败: {e}")
+            reporter.update(i)
+        await reporter.finish(f"🗂️ 面板消息索引回填完成：{done}/{len(todo)} 个频道")
 
-        async def wait_and_run():
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.backfill_started:
+            return
+        self.backfill_started = True
+        # 按钮的 custom_id 固定、回调只依赖 interaction.channel_id，
+        # 注册一个不绑定消息的持久化视图即可接管所有频道的面板按钮
+        self.bot.add_view(MainPanelView(None))
+        await self.backfill_all_panel_indexes()
+        await self.reconcile_panels()
+
+    async def verify_panel(self, cid):
+        """核对单个频道的面板：还在返回 ok，缺失则交给刷新工作池重发。"""
+        channel = self.bot.get_channel(int(cid))
+        config = db.get_config(cid)
+        if channel is None or not config:
+            return "failed"
+        last_id = config.get("last_panel_id")
+        if last_id and channel.last_message_id == last_id:
+            # 面板就是频道最后一条消息，无需请求
+            return "ok"
+        if last_id:
             try:
-                await asyncio.sleep(4)
-                await self.run_refresh_logic(channel)
-            except asyncio.CancelledError: pass
-            finally:
-                if cid in self.scheduled_tasks and self.scheduled_tasks[cid] == asyncio.current_task():
-                    del self.scheduled_tasks[cid]
-        self.scheduled_tasks[cid] = asyncio.create_task(wait_and_run())
-
-    def build_qa_embeds(self, config, qa):
-        raw_text = qa.get("a", "")
-        md_images = re.findall(r'!\[.*?\]\((https?://.*?\.(?:png|jpg|jpeg|gif|webp).*?)\)', raw_text, re.IGNORECASE)
-        clean_text = re.sub(r'!\[.*?\]\(https?://.*?\)', '', raw_text).strip() or "（查看图片）"
-
-        embeds = []
-        main_embed = discord.Embed(
-            title=f"Q: {qa.get('q', '未命名问题')}",
-            description=clean_text,
-            color=config.get("color", 0xffc0cb),
+                await channel.fetch_message(last_id)
+                return "ok"
+            except discord.NotFound:
+                pass
+        self.refresh_pool.submit(channel)
+        return "resent"
+
+    async def reconcile_panels(self):
+        """启动核对：限制并发、限定总时长，只重发确实缺失的面板。"""
+        queue = deque(db.data["channels"])
+        total = len(queue)
+        if not total:
+            return
+        deadline = time.monotonic() + RECONCILE_BUDGET
+        stats = {"ok": 0, "resent": 0, "failed": 0, "skipped": 0}
+        self.reconcile_stats = stats
+        reporter = ProgressReporter(
+            print_progress,
+            lambda r: f"🩺 面板核对进度 {r.done}/{r.total} 个频道，预计剩余 {r.eta_text()}",
+            interval=BACKFILL_PROGRESS_INTERVAL,
+            total=total,
+        ).start()
+
+        async def worker():
+            while queue and time.monotonic() < deadline:
+                cid = queue.popleft()
+                try:
+                    # 单个频道也受剩余预算约束：慢请求或限速等待超时即取消
+                    stats[await asyncio.wait_for(self.verify_panel(cid), deadline - time.monotonic())] += 1
+                except asyncio.TimeoutError:
+                    stats["skipped"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"⚠️ 频道 {cid} 面板核对失败: {e}")
+                reporter.update(total - len(queue))
+
+        with priority.api_priority(priority.REFRESH):
+            await asyncio.gather(*(worker() for _ in range(RECONCILE_CONCURRENCY)))
+        stats["skipped"] += len(queue)
+        await reporter.finish(
+            f"🩺 面板核对完成：正常 {stats['ok']} · 重发 {stats['resent']} · 失败 {stats['failed']}"
+            + (f" · 超出时间预算未核对 {stats['skipped']}" if stats["skipped"] else "")
         )
 
-        if md_images:
-            main_embed.set_image(url=md_images[0])
-            embeds.append(main_embed)
-            for img_url in md_images[1:4]:
-                extra_embed = discord.Embed(color=config.get("color", 0xffc0cb))
-                extra_embed.set_image(url=img_url)
-                embeds.append(extra_embed)
-        else:
-            embeds.append(main_embed)
+    def build_panel_embed(self, config):
+        embed = discord.Embed(
+            title=config["title"],
+            description=f"作者：{config['author']} | 版本：{config['version']}\n\n{config['welcome']}\n\n---\n{config['downloads']}",
+            color=config["color"]
+        )
+        embed.set_footer(text=f"最后刷新时间")
+        embed.timestamp = discord.utils.utcnow()
+        return embed
 
-        return embeds
+    def schedule_refresh(self, channel: discord.TextChannel):
+        self.refresh_scheduler.touch(channel)
 
     @commands.Cog.listener()
     async def on_message(self, message):
+        if not db.is_authorized(message.channel.id): return
+        cid = message.channel.id
+        # 面板之后的每条消息都会把面板往上推，包括机器人自己和其他机器人的消息
+        if cid in self.messages_since_panel and not self.is_panel_message(cid, message.id):
+            self.messages_since_panel[cid] += 1
         if message.author.id == self.bot.user.id: return
-        if db.is_authorized(message.channel.id):
-            await self.schedule_refresh(message.channel)
+        self.schedule_refresh(message.channel)
+
+    @staticmethod
+    def is_panel_message(cid, message_id):
+        config = db.get_config(cid)
+        if not config: return False
+        return message_id == config.get("last_panel_id") or message_id in config.get("panel_ids", ())
 
     @commands.message_command(name="面板答疑")
     async def panel_qa_context(self, ctx, message: discord.Message):
+        if not panel_menu_limiter.allow((ctx.author.id, ctx.channel_id)):
+            return await ctx.respond(THROTTLE_MESSAGE, ephemeral=True)
         config = db.get_config(str(message.channel.id))
         if not config:
             return await ctx.respond("❌ 该频道未授权自助面板。", ephemeral=True)
@@ -673,8 +947,8 @@ class SelfPanel(discord.Cog):
         if not qa_list:
             return await ctx.respond("❌ 当前频道暂无面板答疑内容。", ephemeral=True)
 
-        view = PanelRightClickSelectView(self, message)
-        await ctx.respond(view.page_text(), view=view, ephemeral=True)
+        content, view = reply_menu(message.channel.id, message.id)
+        await ctx.respond(content, view=view, ephemeral=True)
 
     panel_group = SlashCommandGroup("自助面板", "原有的小餐车面板管理")
 
@@ -692,6 +966,7 @@ class SelfPanel(discord.Cog):
             return await ctx.respond("❌ 仅超级管理员可用", ephemeral=True)
         new_config = copy.deepcopy(DEFAULT_TEMPLATE)
         new_config["manager_id"] = manager.id
+        new_config["panel_ids"] = []
         db.set_config(ctx.channel.id, new_config)
         await ctx.respond(f"✅ 授权成功，负责人: {manager.mention}", ephemeral=True)
 
@@ -703,15 +978,116 @@ class SelfPanel(discord.Cog):
         await ctx.defer(ephemeral=True)
         result = db.repair_isolation()
 
-        # 清理运行时锁，避免历史状态影响后续刷新。
-        self.refresh_locks.clear()
-
         await ctx.followup.send(
             f"✅ 修复完成：共检查 `{result['total']}` 个频道，修复 `{result['fixed']}` 个频道配置。\n"
             "后续请在对应频道执行一次 `/自助面板 初始化` 来重发最新面板。",
             ephemeral=True,
         )
 
+    @panel_group.command(name="运行状态", description="[超管] 查看面板存储与运行指标")
+    async def panel_status(self, ctx):
+        if ctx.author.id != SUPER_ADMIN_ID:
+            return await ctx.respond("❌ 仅超级管理员可用", ephemeral=True)
+
+        stats = db.writer.metrics()
+        embed = discord.Embed(title="📊 面板运行状态", color=0x3498db)
+        embed.add_field(
+            name="存储",
+            value=(
+                f"后端: `{STORAGE_BACKEND}` | 频道数: `{len(db.data['channels'])}`\n"
+                f"修改次数: `{stats['marks']}` | 实际落盘: `{stats['flushes']}` 次 / `{stats['written']}` 个频道\n"
+                f"合并掉的写入: `{stats['coalesced']}` | 待落盘: `{stats['pending']}` | 失败: `{stats['errors']}`\n"
+                f"最近耗时: `{stats['last_flush_ms']:.1f}ms` | 最大耗时: `{stats['max_flush_ms']:.1f}ms`"
+            ),
+            inline=False,
+        )
+
+        scheduler = self.refresh_scheduler
+        pending = scheduler.pending()
+        upcoming = "\n".join(f"<#{cid}> {remain:.1f}s 后" for cid, remain in pending[:5]) or "无"
+        embed.add_field(
+            name="刷新调度",
+            value=(
+                f"等待刷新: `{len(pending)}` 个频道 | 触发: `{scheduler.touches}` 次 | 实际刷新: `{scheduler.fired}` 次\n"
+                f"{upcoming}"
+            ),
+            inline=False,
+        )
+
+        runner = self.refresh_runner.stats
+        embed.add_field(
+            name="刷新状态机",
+            value=(
+                f"进行中: `{len(self.refresh_runner.states())}` 个频道 | 请求: `{runner['requests']}` 次\n"
+                f"实际执行: `{runner['runs']}` 次 | 合并掉的请求: `{runner['coalesced']}` 次"
+            ),
+            inline=False,
+        )
+
+        pool = self.refresh_pool.metrics()
+        embed.add_field(
+            name="刷新工作池",
+            value=(
+                f"排队: `{pool['depth']}` | 执行中: `{pool['active']}`/{REFRESH_CONCURRENCY} | 已完成: `{pool['completed']}`\n"
+                f"排队等待 平均 `{pool['avg_wait']:.2f}s` / P95 `{pool['p95_wait']:.2f}s` / 最大 `{pool['max_wait']:.2f}s`"
+            ),
+            inline=False,
+        )
+
+        lines = []
+        for cls, info in priority.scheduler.snapshot().items():
+            lines.append(
+                f"**{priority.CLASS_NAMES[cls]}** 进行中 `{info['active']}` / 排队 `{info['waiting']}`\n"
+                f"　排队: {info['wait'].summary()}\n　总耗时: {info['latency'].summary()}"
+            )
+        embed.add_field(name="API 优先级调度", value="\n".join(lines), inline=False)
+
+        rs = self.refresh_stats
+        per_refresh = rs["api_calls"] / rs["refreshes"] if rs["refreshes"] else 0
+        embed.add_field(
+            name="面板刷新",
+            value=f"刷新: `{rs['refreshes']}` 次 | 原地编辑: `{rs['edits']}` 次 | 平均 API 调用: `{per_refresh:.2f}` 次/刷新",
+            inline=False,
+        )
+        embed.add_field(
+            name="订阅按钮",
+            value=f"点击: `{sub_stats['clicks']}` 次 | 去重: `{sub_stats['deduped']}` 次 | 身份组编辑: `{sub_stats['edits']}` 次",
+            inline=False,
+        )
+        rc = self.reconcile_stats
+        if rc is not None:
+            embed.add_field(
+                name="启动核对",
+                value=f"正常: `{rc['ok']}` | 重发: `{rc['resent']}` | 失败: `{rc['failed']}` | 超时未核对: `{rc['skipped']}`",
+                inline=False,
+            )
+        embed.add_field(
+            name="交互响应耗时",
+            value="\n".join(
+                f"**{path}** {hist.summary()}" for path, hist in sorted(interaction_latency.items())
+            ) or "暂无数据",
+            inline=False,
+        )
+
+        cs = components.stats
+        embed.add_field(
+            name="无状态菜单",
+            value=(
+                f"分发: `{cs['dispatched']}` 次 | 未知组件: `{cs['unknown']}` | 失败: `{cs['errors']}`\n"
+                f"选项页缓存: `{len(qa_pages)}` 个频道 | 命中 `{qa_pages.hits}` | 重建 `{qa_pages.builds}`"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="组件限流",
+            value="\n".join(
+                f"`{name}` 放行 `{limiter.allowed}` / 拒绝 `{limiter.rejected}` | 活跃桶 `{len(limiter)}`"
+                for name, limiter in limiters.items()
+            ) or "无",
+            inline=False,
+        )
+        await ctx.respond(embed=embed, ephemeral=True)
+
     # 【新增】取消授权功能
     @panel_group.command(name="取消授权", description="[超管] 移除本频道的授权并清理面板")
     async def revoke_channel(self, ctx):
@@ -728,39 +1104,12 @@ class SelfPanel(discord.Cog):
 
         await ctx.defer(ephemeral=True)
 
-        # 3. 清理 Discord 频道内的旧面板消息
-        # 逻辑：复用 run_refresh_logic 的清理部分，但不重发新面板
+        # 3. 按面板消息索引清理 Discord 频道内的旧面板消息
+        panel_ids = list(config.get("panel_ids", ()))
+        if not panel_ids and config.get("last_panel_id"):
+            panel_ids = [config["last_panel_id"]]
         try:
-            messages_to_delete = []
-            async for message in ctx.channel.history(limit=100): 
-                if message.author.id != self.bot.user.id: continue
-                
-                is_target = False
-                
-                # 判定方式 A: Embed 标题匹配
-                if message.embeds and message.embeds[0].title == config.get("title"):
-                    is_target = True
-                
-                # 判定方式 B: 按钮 ID 匹配 (更稳健，防止标题已改)
-                if not is_target and message.components:
-                    for component in message.components:
-                        if isinstance(component, discord.ActionRow):
-                            for child in component.children:
-                                if hasattr(child, "custom_id") and child.custom_id in ["ivory_qa_btn", "ivory_sub_btn"]:
-                                    is_target = True
-                                    break
-                        if is_target: break
-                
-                if is_target:
-                    messages_to_delete.append(message)
-
-            if messages_to_delete:
-                if len(messages_to_delete) == 1:
-                    await messages_to_delete[0].delete()
-                else:
-                    await ctx.channel.delete_messages(messages_to_delete)
-        except discord.NotFound:
-            pass
+            await self.delete_panel_messages(ctx.channel, panel_ids)
         except Exception as e:
             print(f"删除面板消息时出错: {e}")
 
@@ -768,9 +1117,7 @@ class SelfPanel(discord.Cog):
         success = db.delete_config(cid)
 
         # 5. 停止可能的定时任务
-        if ctx.channel.id in self.scheduled_tasks:
-            self.scheduled_tasks[ctx.channel.id].cancel()
-            del self.scheduled_tasks[ctx.channel.id]
+        self.refresh_scheduler.cancel(ctx.channel.id)
         
         # 6. 反馈
         if success:
@@ -829,6 +1176,28 @@ class SelfPanel(discord.Cog):
         config = db.get_config(ctx.channel.id)
         await ctx.send_modal(EditContentModal(config, self))
 
+    @panel_group.command(name="重建索引", description="[超管] 扫描历史消息，重建本频道的面板消息索引")
+    async def rebuild_panel_index(self, ctx):
+        if ctx.author.id != SUPER_ADMIN_ID:
+            return await ctx.respond("❌ 仅超级管理员可用", ephemeral=True)
+        if not db.is_authorized(ctx.channel.id):
+            return await ctx.respond("❌ 此频道未授权", ephemeral=True)
+
+        await ctx.defer(ephemeral=True)
+        count = await self.backfill_panel_index(ctx.channel)
+        await ctx.followup.send(f"✅ 索引重建完成，当前记录了 {count} 条面板消息。", ephemeral=True)
+
+    @panel_group.command(name="刷新模式", description="设置面板刷新方式：置底重发 / 原地编辑")
+    async def set_refresh_mode(
+        self,
+        ctx,
+        mode: Option(str, "原地编辑：面板仍在最新几条消息内时直接编辑，不再删除重发", choices=list(REFRESH_MODES)),
+    ):
+        perm, msg = self.check_perm(ctx)
+        if not perm: return await ctx.respond(msg, ephemeral=True)
+        db.update_config(ctx.channel.id, refresh_mode=REFRESH_MODES[mode])
+        await ctx.respond(f"✅ 刷新模式已设置为：`{mode}`", ephemeral=True)
+
     @panel_group.command(name="设置订阅", description="配置点击“订阅更新”按钮时分配的身份组")
     async def config_sub_roles(self, ctx):
         if ctx.author.id != SUPER_ADMIN_ID:
@@ -853,7 +1222,7 @@ class SelfPanel(discord.Cog):
         payload = {
             "version": 1,
             "channel_id": ctx.channel.id,
-            "qa_list": config.get("qa_list", []),
+            "qa_list": thaw(config.get("qa_list", [])),
         }
 
         json_bytes = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
@@ -918,10 +1287,13 @@ class SelfPanel(discord.Cog):
             if not q:
                 return await ctx.followup.send(f"❌ 第 {idx} 项的 q 不能为空。", ephemeral=True)
 
-            normalized.append({"q": q, "a": a})
+            entry = {"q": q, "a": a}
+            if isinstance(item.get("id"), str) and item["id"]:
+                # 导出文件里带的 id 原样保留，重复的会在写入时重新分配
+                entry["id"] = item["id"]
+            normalized.append(entry)
 
-        config["qa_list"] = normalized
-        db.set_config(ctx.channel.id, config)
+        db.update_config(ctx.channel.id, qa_list=normalized)
 
         await self.run_refresh_logic(ctx.channel)
         await ctx.followup.send(f"✅ 导入完成，当前频道答疑共 {len(normalized)} 条。", ephemeral=True)
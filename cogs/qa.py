@@ -1,14 +1,26 @@
 import discord
 from discord.ext import commands
 from discord.commands import SlashCommandGroup, Option
+import asyncio
 import json
 import os
-import re
+
+from utils import components, render
+from utils.search import TitleIndex, fulltext
+from utils.qastore import LazyQAStore
+from utils.ratelimit import THROTTLE_MESSAGE, component_limiter
 
 # ================= 配置 =================
-QA_FILE = "qa_data.json"
+QA_FILE = "qa_data.json"  # 旧版整库 JSON，仅用于首次迁移
+QA_INDEX_FILE = "qa_index.json"
+QA_BODY_FILE = "qa_bodies.bin"
 ADMIN_ROLE_ID = 1420698551138385982  # 指定的有权限操作的身份组ID
-PAGE_SIZE = 25
+# 右键“快速答疑”限流：(每秒补充令牌数, 桶容量)，按 (用户, 频道) 计
+QUICK_MENU_LIMIT = (0.5, 3)
+# 全文索引后台建立中时，搜索最多等待多少秒，超时则改为按标题搜索
+SEARCH_BUILD_WAIT = 2.0
+
+quick_menu_limiter = component_limiter("快速答疑", *QUICK_MENU_LIMIT)
 
 # 初始数据文本
 INITIAL_MARKDOWN = """
@@ -112,98 +124,21 @@ https://discord.com/channels/1291925535324110879/1429039503808659517
 
 # ================= 辅助 UI 组件 =================
 
-# 1. 右键菜单专用的选择视图
-class RightClickSelectView(discord.ui.View):
-    def __init__(self, cog, target_message, page=0):
-        super().__init__(timeout=120)
-        self.cog = cog
-        self.target_message = target_message
-        self.keys = list(cog.qa_data.keys())
-        self.page = max(0, page)
-        self.total_pages = max(1, (len(self.keys) + PAGE_SIZE - 1) // PAGE_SIZE)
-        self.page = min(self.page, self.total_pages - 1)
-        self.refresh_items()
-
-    def page_text(self):
-        return f"请选择要回复的条目（第 {self.page + 1}/{self.total_pages} 页）："
-
-    def get_page_slice(self):
-        start = self.page * PAGE_SIZE
-        end = start + PAGE_SIZE
-        return start, self.keys[start:end]
-
-    def refresh_items(self):
-        self.clear_items()
-        self.add_item(RightClickSelect(self))
-
-        prev_btn = RightClickPageButton(-1)
-        next_btn = RightClickPageButton(1)
-        prev_btn.disabled = self.page <= 0
-        next_btn.disabled = self.page >= self.total_pages - 1
-        self.add_item(prev_btn)
-        self.add_item(next_btn)
-
-
-class RightClickPageButton(discord.ui.Button):
-    def __init__(self, step):
-        self.step = step
-        label = "⬅️ 上一页" if step < 0 else "下一页 ➡️"
-        super().__init__(label=label, style=discord.ButtonStyle.secondary, row=1)
-
-    async def callback(self, interaction: discord.Interaction):
-        view = self.view
-        if not isinstance(view, RightClickSelectView):
-            return await interaction.response.send_message("❌ 视图状态异常，请重新打开菜单。", ephemeral=True)
-
-        new_page = view.page + self.step
-        new_page = max(0, min(new_page, view.total_pages - 1))
-        if new_page == view.page:
-            return await interaction.response.defer()
-
-        view.page = new_page
-        view.refresh_items()
-        await interaction.response.edit_message(content=view.page_text(), view=view)
-
-class RightClickSelect(discord.ui.Select):
-    def __init__(self, parent_view: RightClickSelectView):
-        self.parent_view = parent_view
-        start, page_keys = parent_view.get_page_slice()
-
-        options = []
-        for offset, k in enumerate(page_keys):
-            label = k[:100]
-            options.append(discord.SelectOption(label=label, value=str(start + offset)))
-
-        if not options:
-            options.append(discord.SelectOption(label="暂无可用条目", value="-1", default=True))
-
-        super().__init__(
-            placeholder="👇 请选择要回复的答疑内容...",
-            min_values=1,
-            max_values=1,
-            options=options,
-            disabled=(len(page_keys) == 0),
-        )
-
-    async def callback(self, interaction: discord.Interaction):
-        picked = self.values[0]
-        if picked == "-1":
-            return await interaction.response.defer()
-
-        idx = int(picked)
-        if not (0 <= idx < len(self.parent_view.keys)):
-            return await interaction.response.edit_message(content="❌ 条目不存在或已被删除，请重新打开菜单。", view=None)
-
-        query = self.parent_view.keys[idx]
-        try:
-            embeds = self.parent_view.cog.get_qa_payload(query)
-            await self.parent_view.target_message.reply(content=None, embeds=embeds, mention_author=True)
-            await interaction.response.edit_message(content=f"✅ 已成功回复关于 **{query}** 的内容！", view=None)
-        except discord.Forbidden:
-            await interaction.response.edit_message(content="❌ 无法回复该消息（可能我没有权限或被拉黑）。", view=None)
-        except Exception as e:
-            if not interaction.response.is_done():
-                await interaction.response.edit_message(content=f"❌ 发送失败: {e}", view=None)
+# 1. 右键菜单（无状态组件）：目标消息和页码编码在 custom_id 里
+#   ivq:rs:<目标消息>  选择条目    ivq:rp:<目标消息>:<页>  翻页
+# 选项的值是条目的稳定 id（"#id"），翻页期间条目增删也不会错位
+def reply_entries(store):
+    return [(title[:100], f"#{store.entry_id(title)}") for title in store]
+
+def build_reply_menu(pages, message_id, page=0):
+    page, view = components.paged_select(
+        pages, page,
+        components.custom_id("ivq:rs", message_id),
+        lambda p: components.custom_id("ivq:rp", message_id, p),
+        "👇 请选择要回复的答疑内容...", "暂无可用条目",
+    )
+    content = f"请选择要回复的条目（第 {page + 1}/{len(pages)} 页）："
+    return content, view
 
 # 2. 新增条目的 Modal (弹窗)
 class AddEntryModal(discord.ui.Modal):
@@ -232,6 +167,8 @@ class AddEntryModal(discord.ui.Modal):
             return await interaction.response.send_message("❌ 该标题已存在，请使用【修改】功能。", ephemeral=True)
             
         self.cog.qa_data[title] = content
+        self.cog.title_index.add(title)
+        fulltext.add("qa", ("qa", title), title, content, {"title": title})
         self.cog.save_data()
         await interaction.response.send_message(f"✅ 已添加新条目：`{title}`", ephemeral=True)
 
@@ -261,15 +198,23 @@ class EditEntryModal(discord.ui.Modal):
         new_title = self.children[0].value.strip()
         new_content = self.children[1].value.strip()
         
+        if self.original_title not in self.cog.qa_data:
+            return await interaction.response.send_message("❌ 原条目已被删除，修改失败。", ephemeral=True)
+
         # 如果改了标题，需要判断新标题是否冲突
         if new_title != self.original_title and new_title in self.cog.qa_data:
              return await interaction.response.send_message("❌ 修改后的标题已存在其他条目中，修改失败。", ephemeral=True)
         
-        # 如果改了标题，删除旧key
+        render.invalidate(self.cog.qa_data.get(self.original_title))
+
+        # 如果改了标题：原地改名，保留条目 id，已打开的菜单仍然指向它
         if new_title != self.original_title:
-            del self.cog.qa_data[self.original_title]
+            self.cog.qa_data.rename(self.original_title, new_title)
+            self.cog.title_index.rename(self.original_title, new_title)
+            fulltext.remove(("qa", self.original_title))
             
         self.cog.qa_data[new_title] = new_content
+        fulltext.add("qa", ("qa", new_title), new_title, new_content, {"title": new_title})
         self.cog.save_data()
         
         msg = f"✅ 已更新条目：`{new_title}`"
@@ -284,26 +229,69 @@ class EditEntryModal(discord.ui.Modal):
 class QuickQA(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.qa_data = {}
+        # 标题常驻内存，回答正文按需从内存映射文件读取
+        self.qa_data = LazyQAStore(QA_BODY_FILE, QA_INDEX_FILE)
+        self.title_index = TitleIndex()
+        self.page_cache = components.PageCache()
+        fulltext.register_source("qa", self._fulltext_docs)
+        components.register("ivq:rs", self.on_reply_select)
+        components.register("ivq:rp", self.on_reply_page)
         self.load_data()
 
     def load_data(self):
-        if os.path.exists(QA_FILE):
+        if not self.qa_data and not os.path.exists(QA_INDEX_FILE) and os.path.exists(QA_FILE):
+            # 一次性迁移旧版 qa_data.json
             try:
                 with open(QA_FILE, "r", encoding="utf-8") as f:
-                    self.qa_data = json.load(f)
+                    self.qa_data.replace_all(json.load(f))
+                print(f"📦 已从 {QA_FILE} 迁移 {len(self.qa_data)} 条答疑")
             except Exception as e:
                 print(f"⚠️ QA数据加载失败: {e}")
-                self.qa_data = {}
         
         if not self.qa_data:
             print("⏳ 初始化默认答疑库...")
             self.parse_markdown_to_data(INITIAL_MARKDOWN)
             self.save_data()
 
+        self.title_index.rebuild(self.qa_data)
+
     def save_data(self):
-        with open(QA_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.qa_data, f, ensure_ascii=False, indent=4)
+        self.qa_data.save()
+
+    def cog_unload(self):
+        components.unregister("ivq:rs")
+        components.unregister("ivq:rp")
+        self.qa_data.close()
+
+    def reply_pages(self):
+        # 标题未增删时翻页直接复用已构建的选项
+        return self.page_cache.get("reply", self.qa_data.version, lambda: reply_entries(self.qa_data))
+
+    async def on_reply_page(self, interaction, message_id, page):
+        content, view = build_reply_menu(self.reply_pages(), message_id, int(page))
+        await interaction.response.edit_message(content=content, view=view)
+
+    async def on_reply_select(self, interaction, message_id):
+        picked = interaction.data["values"][0]
+        if picked == "-1":
+            return await interaction.response.defer()
+
+        query = picked
+        if picked.startswith("#") and picked[1:].isdigit():
+            query = self.qa_data.title_of(int(picked[1:]))
+        if query not in self.qa_data:
+            return await interaction.response.edit_message(content="❌ 条目不存在或已被删除，请重新打开菜单。", view=None)
+
+        target_message = interaction.channel.get_partial_message(int(message_id))
+        try:
+            embeds = self.get_qa_payload(query)
+            await target_message.reply(content=None, embeds=embeds, mention_author=True)
+            await interaction.response.edit_message(content=f"✅ 已成功回复关于 **{query}** 的内容！", view=None)
+        except discord.Forbidden:
+            await interaction.response.edit_message(content="❌ 无法回复该消息（可能我没有权限或被拉黑）。", view=None)
+        except Exception as e:
+            if not interaction.response.is_done():
+                await interaction.response.edit_message(content=f"❌ 发送失败: {e}", view=None)
 
     def parse_markdown_to_data(self, md_text):
         lines = md_text.split('\n')
@@ -325,9 +313,14 @@ class QuickQA(commands.Cog):
         if current_title:
             new_data[current_title] = "\n".join(current_content).strip()
             
-        self.qa_data = new_data
+        self.qa_data.replace_all(new_data)
+        self.title_index.rebuild(new_data)
+        fulltext.replace_group("qa", [(doc_id, title, text, meta) for _, doc_id, title, text, meta in self._fulltext_docs()])
         return len(new_data)
 
+    def _fulltext_docs(self):
+        return [("qa", ("qa", title), title, content, {"title": title}) for title, content in self.qa_data.items()]
+
     def export_data_to_markdown(self):
         md_lines = []
         for title, content in self.qa_data.items():
@@ -337,50 +330,33 @@ class QuickQA(commands.Cog):
         return "\n".join(md_lines)
 
     async def search_qa_titles(self, ctx: discord.AutocompleteContext):
-        user_input = ctx.value.lower()
-        keys = list(self.qa_data.keys())
-        if not user_input:
-            return keys[:25]
-        filtered = [k for k in keys if user_input in k.lower()]
-        return filtered[:25] 
+        return self.title_index.search(ctx.value or "", limit=25)
 
     def get_qa_payload(self, query):
-        content = self.qa_data[query]
-        images = re.findall(r'(https?://.*?\.(?:png|jpg|jpeg|gif|webp))', content, re.IGNORECASE)
-        clean_text = content
-        clean_text = re.sub(r'!\[.*?\]\(https?://.*?\.(?:png|jpg|jpeg|gif|webp).*?\)', '', clean_text, flags=re.IGNORECASE)
-        for img in images:
-            clean_text = clean_text.replace(img, "")
-        clean_text = clean_text.strip()
-        if not clean_text:
-            clean_text = "（请查看下方图片详情）"
-
-        embeds = []
-        main_embed = discord.Embed(
-            title=f"💡 关于 {query}",
-            description=clean_text, 
-            color=0x00ff00
+        return render.build_embeds(
+            f"💡 关于 {query}",
+            self.qa_data[query],
+            0x00ff00,
+            placeholder="（请查看下方图片详情）",
+            gallery_url="https://discord.com",
         )
-        if images:
-            main_embed.set_image(url=images[0])
-            embeds.append(main_embed)
-            for img_url in images[1:4]:
-                sub_embed = discord.Embed(url="https://discord.com", color=0x00ff00)
-                sub_embed.set_image(url=img_url)
-                embeds.append(sub_embed)
-        else:
-            embeds.append(main_embed)
-
-        return embeds
 
     # ================= 命令注册 =================
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # 启动后在后台线程建立全文索引，之后随编辑增量更新
+        if not fulltext.built:
+            await fulltext.build_in_background()
+
     @commands.message_command(name="快速答疑")
     async def quick_qa_context(self, ctx, message: discord.Message):
+        if not quick_menu_limiter.allow((ctx.author.id, ctx.channel_id)):
+            return await ctx.respond(THROTTLE_MESSAGE, ephemeral=True)
         if not self.qa_data:
             return await ctx.respond("❌ 答疑库为空，请先添加内容。", ephemeral=True)
-        view = RightClickSelectView(self, message)
-        await ctx.respond(view.page_text(), view=view, ephemeral=True)
+        content, view = build_reply_menu(self.reply_pages(), message.id)
+        await ctx.respond(content, view=view, ephemeral=True)
 
     qa_group = SlashCommandGroup("快速答疑", "答疑库相关操作")
 
@@ -396,6 +372,42 @@ class QuickQA(commands.Cog):
         embeds = self.get_qa_payload(query)
         await ctx.respond(content=f"{user.mention} 👇", embeds=embeds)
 
+    @qa_group.command(name="搜索", description="在答疑库和所有面板的回答正文中全文搜索")
+    async def search_content(self, ctx: discord.ApplicationContext, keyword: Option(str, "要搜索的内容")):
+        if fulltext.building:
+            # 索引正在后台建立：稍等片刻，仍未完成就先按标题搜索答疑库
+            try:
+                await asyncio.wait_for(fulltext.build_in_background(), SEARCH_BUILD_WAIT)
+            except asyncio.TimeoutError:
+                pass
+
+        def visible(doc_id, meta):
+            # 只保留本服务器的频道面板，在排名前过滤，避免其他服务器的结果挤占名额
+            return doc_id[0] == "qa" or bool(ctx.guild and ctx.guild.get_channel_or_thread(meta["channel_id"]))
+
+        lines = []
+        footer = "📘 答疑库条目（可用 /快速答疑 回复 发送） | 🛒 频道面板答疑"
+        if fulltext.building:
+            lines = [f"📘 **{title}**" for title in self.title_index.search(keyword, limit=10)]
+            footer = "⏳ 全文索引仍在建立，暂时只按答疑库标题匹配"
+        else:
+            for doc_id, score, meta in fulltext.search(keyword, limit=10, accept=visible):
+                if doc_id[0] == "qa":
+                    lines.append(f"📘 **{meta['title']}**")
+                else:
+                    lines.append(f"🛒 <#{meta['channel_id']}> **{meta['title']}**")
+
+        if not lines:
+            return await ctx.respond(f"🔍 没有找到与 `{keyword}` 相关的内容。", ephemeral=True)
+
+        embed = discord.Embed(
+            title=f"🔍 “{keyword}” 的搜索结果",
+            description="\n".join(f"{i}. {line}" for i, line in enumerate(lines, 1)),
+            color=0x00ff00,
+        )
+        embed.set_footer(text=footer)
+        await ctx.respond(embed=embed, ephemeral=True)
+
    # ================= 管理功能 =================
     def is_qa_admin():
         def predicate(ctx):
@@ -435,7 +447,10 @@ class QuickQA(commands.Cog):
     @is_qa_admin()
     async def delete_entry(self, ctx, query: Option(str, "选择要删除的条目", autocomplete=search_qa_titles)):
         if query in self.qa_data:
+            render.invalidate(self.qa_data[query])
             del self.qa_data[query]
+            self.title_index.remove(query)
+            fulltext.remove(("qa", query))
             self.save_data()
             await ctx.respond(f"🗑️ 已删除条目：`{query}`", ephemeral=True)
         else:
@@ -468,7 +483,6 @@ class QuickQA(commands.Cog):
     @qa_group.command(name="初始化重置", description="[管理] ⚠️危险：清空所有数据并恢复为默认预设")
     @is_qa_admin()
     async def reset_to_default(self, ctx):
-        self.qa_data = {}
         count = self.parse_markdown_to_data(INITIAL_MARKDOWN)
         self.save_data()
         await ctx.respond(f"✅ 已执行硬重置！数据已恢复为默认预设（共 {count} 条）。", ephemeral=True)
@@ -3,6 +3,7 @@
 import discord
 import os
 from dotenv import load_dotenv
+from utils import components, priority, ratelimit
 
 # 加载环境变量
 load_dotenv()
@@ -15,6 +16,13 @@ intents.members = True
 
 # 3. 初始化 Bot 时传入 intents
 bot = discord.Bot(intents=intents)
+
+# 4. 出站请求按优先级调度：交互响应 > 面板刷新 > 批量身份组操作
+priority.install(bot)
+# 5. 读取响应里的限速头，供批量迁移自适应调节并发
+ratelimit.install_tracing(bot.http)
+# 6. 无状态菜单组件：按 custom_id 前缀统一分发
+components.install(bot)
 # ================================================
 
 @bot.event
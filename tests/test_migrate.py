@@ -0,0 +1,39 @@
+# test_migrate.py
+
+from utils.migrate import JobStore
+
+
+def test_checkpoint_appends_and_replays(tmp_path):
+    path = str(tmp_path / "jobs.json")
+    store = JobStore(path)
+    job = store.create(guild_id=1)
+    job["processed"] += [1, 2]
+    store.checkpoint(job)
+    job["processed"].append(3)
+    job["failed"].append(9)
+    store.checkpoint(job)
+
+    with open(f"{path}.log", encoding="utf-8") as f:
+        lines = f.readlines()
+    # 第二条记录只包含新增的 id
+    assert len(lines) == 2 and '"processed": [3]' in lines[1]
+
+    reloaded = JobStore(path).jobs[job["id"]]
+    assert reloaded["processed"] == [1, 2, 3]
+    assert reloaded["failed"] == [9]
+
+
+def test_stale_log_ignored_after_full_save(tmp_path):
+    path = str(tmp_path / "jobs.json")
+    store = JobStore(path)
+    job = store.create(guild_id=1)
+    job["processed"].append(1)
+    store.checkpoint(job)
+    with open(f"{path}.log", encoding="utf-8") as f:
+        stale = f.read()
+    store.save()
+    # 模拟全量保存后、删除日志前进程退出
+    with open(f"{path}.log", "w", encoding="utf-8") as f:
+        f.write(stale + '{"gen": ')
+
+    assert JobStore(path).jobs[job["id"]]["processed"] == [1]
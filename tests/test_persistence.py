@@ -0,0 +1,35 @@
+# test_persistence.py
+
+import json
+
+from utils.persistence import WriteBehindWriter
+from utils.storage import JsonStorage
+
+
+def test_json_partial_mark_keeps_other_channels(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JsonStorage(str(path))
+    storage.commit({"1": {"title": "a"}, "2": {"title": "b"}})
+
+    channels = storage.load()
+    writer = WriteBehindWriter(storage, interval=60, channels=channels)
+    channels["1"] = {"title": "a2"}
+    writer.mark(channels, {"1"})
+    writer.close()
+
+    saved = json.loads(path.read_text(encoding="utf-8"))["channels"]
+    assert saved == {"1": {"title": "a2"}, "2": {"title": "b"}}
+
+
+def test_json_partial_delete(tmp_path):
+    path = tmp_path / "data.json"
+    storage = JsonStorage(str(path))
+    storage.commit({"1": {}, "2": {}})
+
+    channels = storage.load()
+    writer = WriteBehindWriter(storage, interval=60, channels=channels)
+    del channels["2"]
+    writer.mark(channels, {"2"})
+    writer.close()
+
+    assert json.loads(path.read_text(encoding="utf-8"))["channels"] == {"1": {}}
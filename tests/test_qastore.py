@@ -0,0 +1,79 @@
+# test_qastore.py
+
+import pytest
+
+from utils import qastore
+from utils.qastore import LazyQAStore
+
+
+def open_store(tmp_path):
+    return LazyQAStore(str(tmp_path / "bodies.bin"), str(tmp_path / "index.json"))
+
+
+def test_set_delete_reload_keeps_ids(tmp_path):
+    store = open_store(tmp_path)
+    store["a"] = "正文 a"
+    store["b"] = "正文 b"
+    store["c"] = "正文 c"
+    id_b = store.entry_id("b")
+    del store["a"]
+    store["b"] = "新正文 b"
+    store.save()
+    store.close()
+
+    store = open_store(tmp_path)
+    assert list(store) == ["b", "c"]
+    assert store["b"] == "新正文 b" and store["c"] == "正文 c"
+    assert store.entry_id("b") == id_b
+    assert store.title_of(1) is None
+    # 删除后的 id 不会复用
+    store["d"] = "正文 d"
+    assert store.entry_id("d") == 4
+    store.close()
+
+
+def test_rename_keeps_id_body_and_order(tmp_path):
+    store = open_store(tmp_path)
+    store["a"] = "正文 a"
+    store["b"] = "正文 b"
+    entry_id = store.entry_id("a")
+    version = store.version
+    store.rename("a", "a2")
+    assert list(store) == ["a2", "b"]
+    assert store.entry_id("a2") == entry_id and store.title_of(entry_id) == "a2"
+    assert "a" not in store and store.entry_id("a") is None
+    assert store.version > version
+    store.save()
+    store.close()
+
+    store = open_store(tmp_path)
+    assert store["a2"] == "正文 a" and store.entry_id("a2") == entry_id
+    store.close()
+
+
+def test_rename_onto_existing_title_fails(tmp_path):
+    store = open_store(tmp_path)
+    store["a"] = "1"
+    store["b"] = "2"
+    with pytest.raises(KeyError):
+        store.rename("a", "b")
+    assert store["a"] == "1" and store["b"] == "2"
+    store.close()
+
+
+def test_save_compacts_garbage(tmp_path, monkeypatch):
+    monkeypatch.setattr(qastore, "COMPACT_MIN_BYTES", 10)
+    store = open_store(tmp_path)
+    store["a"] = "x" * 20
+    store["b"] = "y" * 5
+    ids = {t: store.entry_id(t) for t in store}
+    store["a"] = "z" * 20
+    del store["b"]
+    store.save()
+    store.close()
+
+    assert (tmp_path / "bodies.bin").stat().st_size == 20
+    store = open_store(tmp_path)
+    assert dict(store.items()) == {"a": "z" * 20}
+    assert store.entry_id("a") == ids["a"]
+    store.close()
@@ -0,0 +1,63 @@
+# test_ratelimit.py
+
+import asyncio
+
+import aiohttp
+
+from utils import ratelimit
+
+
+class HTTPClient:
+    """模拟 py-cord 的 HTTPClient（同名类，私有属性名一致）：会话在 static_login 时才创建。"""
+
+    def __init__(self):
+        self.__session = None
+
+    async def static_login(self, token):
+        self.__session = aiohttp.ClientSession()
+        return token
+
+    def recreate(self):
+        self.__session = aiohttp.ClientSession()
+
+    def session(self):
+        return self.__session
+
+
+def test_trace_config_attached_after_login_and_recreate():
+    async def scenario():
+        http = HTTPClient()
+        assert ratelimit.install_tracing(http)
+        assert await http.static_login("token") == "token"
+        first = http.session()
+        assert ratelimit._TRACE_CONFIG in first.trace_configs
+        http.recreate()
+        second = http.session()
+        assert ratelimit._TRACE_CONFIG in second.trace_configs
+        # 重复挂载不会重复添加
+        await http.static_login("token")
+        third = http.session()
+        assert third.trace_configs.count(ratelimit._TRACE_CONFIG) == 1
+        for session in (first, second, third):
+            await session.close()
+
+    asyncio.run(scenario())
+
+
+def test_missing_session_falls_back(capsys):
+    class RenamedHTTP:
+        async def static_login(self, token):
+            self._session = object()
+
+    async def scenario():
+        http = RenamedHTTP()
+        assert ratelimit.install_tracing(http)
+        await http.static_login("token")
+
+    asyncio.run(scenario())
+    assert "未找到 Bot 的 HTTP 会话" in capsys.readouterr().out
+
+
+def test_missing_login_hook_is_not_installed(capsys):
+    assert ratelimit.install_tracing(object()) is False
+    assert "没有 static_login" in capsys.readouterr().out
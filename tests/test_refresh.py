@@ -0,0 +1,89 @@
+# test_refresh.py
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from utils.refresh import IDLE, CoalescingRunner, RefreshScheduler
+
+
+def test_coalescing_runner_runs_exactly_one_follow_up():
+    async def scenario():
+        calls = []
+        gate = asyncio.Event()
+
+        async def worker(channel):
+            calls.append(channel.tag)
+            if len(calls) == 1:
+                await gate.wait()
+
+        runner = CoalescingRunner(worker)
+        first = asyncio.create_task(runner.request(SimpleNamespace(id=1, tag="a")))
+        await asyncio.sleep(0)
+        # 运行期间的多次请求只合并成一次后续执行，并使用最新的频道对象
+        results = [await runner.request(SimpleNamespace(id=1, tag=tag)) for tag in "bcd"]
+        gate.set()
+        assert await first is True
+        return calls, results, runner
+
+    calls, results, runner = asyncio.run(scenario())
+    assert calls == ["a", "d"]
+    assert results == [False, False, False]
+    assert runner.stats == {"requests": 4, "runs": 2, "coalesced": 2}
+    assert runner.state(1) == IDLE
+
+
+def test_coalescing_runner_no_follow_up_without_new_requests():
+    async def scenario():
+        calls = []
+
+        async def worker(channel):
+            calls.append(channel.id)
+
+        runner = CoalescingRunner(worker)
+        await runner.request(SimpleNamespace(id=1))
+        await runner.request(SimpleNamespace(id=1))
+        return calls
+
+    assert asyncio.run(scenario()) == [1, 1]
+
+
+def test_scheduler_fires_by_max_wait_under_constant_traffic():
+    async def scenario():
+        fired = []
+
+        async def callback(channel):
+            fired.append(time.monotonic())
+
+        scheduler = RefreshScheduler(callback, delay=0.1, max_wait=0.3)
+        channel = SimpleNamespace(id=1)
+        start = time.monotonic()
+        # 每 0.05 秒来一条消息，安静期永远等不到，只能靠最长等待触发
+        while time.monotonic() - start < 0.5:
+            scheduler.touch(channel)
+            await asyncio.sleep(0.05)
+        scheduler.stop()
+        return start, fired
+
+    start, fired = asyncio.run(scenario())
+    assert fired
+    assert 0.25 <= fired[0] - start < 0.4
+
+
+def test_scheduler_debounces_to_one_refresh():
+    async def scenario():
+        fired = []
+
+        async def callback(channel):
+            fired.append(channel.id)
+
+        scheduler = RefreshScheduler(callback, delay=0.05, max_wait=1.0)
+        for _ in range(5):
+            scheduler.touch(SimpleNamespace(id=1))
+        await asyncio.sleep(0.15)
+        scheduler.stop()
+        return fired, scheduler
+
+    fired, scheduler = asyncio.run(scenario())
+    assert fired == [1]
+    assert scheduler.touches == 5 and scheduler.fired == 1
@@ -0,0 +1,39 @@
+# test_render.py
+
+from utils import render
+
+CONTENT = (
+    "说明 ![图1](https://a.com/1.png) 文字\n"
+    "https://b.com/2.JPG?size=large\n"
+    "![链接](https://c.com/page) [Wiki](https://d.com/wiki)\n"
+    "https://e.com/not-image.pngx ![重复](https://a.com/1.png)"
+)
+
+
+def test_quick_qa_extracts_markdown_and_bare_images_in_order():
+    rendered = render._parse(CONTENT)
+    assert rendered.images == ("https://a.com/1.png", "https://b.com/2.JPG?size=large")
+    assert "https://b.com/2.JPG" not in rendered.text
+    assert "![" not in rendered.text
+    assert "[Wiki](https://d.com/wiki)" in rendered.text
+    assert "https://e.com/not-image.pngx" in rendered.text
+
+
+def test_panel_keeps_bare_image_links_in_text():
+    rendered = render._parse(CONTENT, bare_images=False)
+    assert rendered.images == ("https://a.com/1.png",)
+    assert "https://b.com/2.JPG?size=large" in rendered.text
+    assert "![" not in rendered.text
+
+
+def test_caches_are_separate_per_rule():
+    render.invalidate(CONTENT)
+    assert render.parse(CONTENT) is not render.parse(CONTENT, bare_images=False)
+    assert render.parse(CONTENT, bare_images=False) is render.parse(CONTENT, bare_images=False)
+
+
+def test_build_embeds_uses_placeholder_and_gallery():
+    embeds = render.build_embeds("Q", "![a](https://a.com/1.png) ![b](https://a.com/2.gif)", 1, "（查看图片）", gallery_url="https://g")
+    assert embeds[0].description == "（查看图片）"
+    assert embeds[0].image.url == "https://a.com/1.png"
+    assert embeds[1].image.url == "https://a.com/2.gif" and embeds[1].url == "https://g"
@@ -0,0 +1,53 @@
+# test_roleplan.py
+
+import pytest
+
+from utils.roleplan import PlanError, RolePlan, parse_expression
+
+ROLES = {"A": 1, "B": 2, "C": 3}
+
+
+def parse(text):
+    return parse_expression(text, lambda value: ROLES.get(value) or (int(value) if value.isdigit() else None))
+
+
+def test_and_binds_tighter_than_or():
+    assert str(parse("A | B & C")) == "(<@&1> | (<@&2> & <@&3>))"
+    assert str(parse("A & B | C")) == "((<@&1> & <@&2>) | <@&3>)"
+
+
+def test_or_and_minus_associate_left():
+    # | 和 - 同级：A - B | C 是 (A - B) | C，而不是 A - (B | C)
+    expr = parse("A - B | C")
+    assert str(expr) == "((<@&1> - <@&2>) | <@&3>)"
+    assert expr.matches({2, 3})
+    assert str(parse("A | B - C")) == "((<@&1> | <@&2>) - <@&3>)"
+
+
+def test_parentheses_and_mentions():
+    expr = parse("(<@&1> | 2) - C")
+    assert expr.matches({1}) and expr.matches({2})
+    assert not expr.matches({1, 3})
+    assert expr.role_ids() == {1, 2, 3}
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "条件不能为空"),
+    ("A |", "此处需要身份组"),
+    ("(A | B", "括号不匹配"),
+    ("A B", "多余的内容"),
+    ("A | D", "找不到身份组: D"),
+    ("A ) B", "多余的内容"),
+])
+def test_parse_errors(text, message):
+    with pytest.raises(PlanError, match=message):
+        parse(text)
+
+
+def test_final_roles_and_dry_run():
+    plan = RolePlan(parse("A - C"), add={2}, remove={1})
+    assert plan.final_roles(frozenset({1})) == {2}
+    assert plan.final_roles(frozenset({1, 3})) is None
+    assert plan.final_roles(frozenset({2})) is None
+    stats = plan.dry_run([frozenset({1}), frozenset({1, 2}), frozenset({1, 3}), frozenset()])
+    assert stats == {"matched": 2, "changed": 2, "added": 1, "removed": 2}
@@ -0,0 +1,66 @@
+# test_search.py
+
+import asyncio
+
+from utils.search import FullTextIndex, TitleIndex
+
+
+def test_title_index_ranks_prefix_before_substring_before_fuzzy():
+    index = TitleIndex(["报错处理大全", "常见报错", "报错", "预设报错说明", "报告错误"])
+    # 前缀命中按长度排序，子串命中按出现位置排序，最后才是模糊匹配
+    assert index.search("报错") == ["报错", "报错处理大全", "常见报错", "预设报错说明"]
+    assert index.search("错误报告") == ["报告错误"]
+
+
+def test_title_index_rename_and_remove():
+    index = TitleIndex(["快速回复", "预设"])
+    index.search("快速")
+    index.rename("快速回复", "快捷回复")
+    assert index.search("快速") == []
+    assert index.search("快捷") == ["快捷回复"]
+    index.remove("预设")
+    assert len(index) == 1
+
+
+def _docs():
+    return [
+        ("g", "a", "截断", "回复截断时关闭流式传输", {"title": "截断"}),
+        ("g", "b", "流式传输", "流式传输设置说明", {"title": "流式传输"}),
+        ("g", "c", "快速回复", "导入快速回复文件", {"title": "快速回复"}),
+    ]
+
+
+def test_fulltext_ranks_title_hits_higher():
+    index = FullTextIndex()
+    index.register_source("g", _docs)
+    ids = [doc_id for doc_id, score, meta in index.search("流式传输")]
+    assert ids[:2] == ["b", "a"]
+    assert "c" not in ids
+
+
+def test_fulltext_accept_filters_before_limit():
+    index = FullTextIndex()
+    index.register_source("g", _docs)
+    results = index.search("流式传输", limit=1, accept=lambda doc_id, meta: doc_id != "b")
+    assert [doc_id for doc_id, score, meta in results] == ["a"]
+
+
+def test_fulltext_updates_during_build_are_applied_after():
+    async def scenario():
+        index = FullTextIndex()
+        index.register_source("g", _docs)
+        build = asyncio.create_task(index.build_in_background())
+        await asyncio.sleep(0)
+        assert index.building
+        assert index.search("流式") == []
+        # 建立期间的增量更新先排队，建完后按顺序补上
+        index.add("g", "d", "模型选择", "流式输出需要模型支持", {"title": "模型选择"})
+        index.remove("a")
+        index.replace_group("h", [("e", "其他", "其他流式说明", {"title": "其他"})])
+        await build
+        return index
+
+    index = asyncio.run(scenario())
+    assert index.built and not index.building
+    ids = {doc_id for doc_id, score, meta in index.search("流式", limit=10)}
+    assert ids == {"b", "d", "e"}
@@ -0,0 +1,159 @@
+# components.py
+
+import asyncio
+
+import discord
+
+# ================= 无状态组件 =================
+# 菜单的状态（频道、页码、目标消息 id）直接编码在 custom_id 里，例如 "ivp:qp:123:2"。
+# 发送时视图先 stop()，py-cord 不会把它存进 ViewStore；点击由全局 on_interaction 按前缀分发。
+# 打开的菜单不占内存、没有超时，重启后依然可用。
+
+SEP = ":"
+_handlers = {}
+stats = {"dispatched": 0, "unknown": 0, "errors": 0}
+
+
+def custom_id(prefix, *args):
+    return SEP.join((prefix, *map(str, args)))
+
+
+def register(prefix, handler):
+    """handler(interaction, *参数字符串)，参数即 custom_id 中前缀之后的部分。"""
+    _handlers[prefix] = handler
+
+
+def unregister(prefix):
+    _handlers.pop(prefix, None)
+
+
+def frozen_view(*items):
+    """构造只用于渲染组件的视图：已停止，发送后不会被 py-cord 跟踪。"""
+    view = discord.ui.View(*items, timeout=None)
+    view.stop()
+    return view
+
+
+async def dispatch(interaction):
+    if interaction.type is not discord.InteractionType.component:
+        return
+    cid = (interaction.data or {}).get("custom_id", "")
+    parts = cid.split(SEP)
+    handler = _handlers.get(SEP.join(parts[:2]))
+    if handler is None:
+        # 持久化按钮等其他组件由 py-cord 自己的 ViewStore 处理
+        if cid.startswith(("ivp" + SEP, "ivq" + SEP)):
+            stats["unknown"] += 1
+        return
+    stats["dispatched"] += 1
+    try:
+        await handler(interaction, *parts[2:])
+    except Exception as e:
+        stats["errors"] += 1
+        print(f"⚠️ 组件 {cid} 处理失败: {e}")
+        if not interaction.response.is_done():
+            try:
+                await interaction.response.send_message(f"❌ 操作失败: {e}", ephemeral=True)
+            except discord.HTTPException:
+                pass
+
+
+# ================= 单次往返响应 =================
+# 数据在内存里时直接 send_message / edit_message；只有真正慢的操作超过 DEFER_AFTER
+# 还没完成，才补一个 defer 防止交互超时（3 秒）。
+
+DEFER_AFTER = 1.5
+
+
+async def within(interaction, aw, timer=None, timeout=DEFER_AFTER):
+    """等待慢操作 aw；超过 timeout 仍未完成时先 defer，返回 aw 的结果。"""
+    task = asyncio.ensure_future(aw)
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if not done and not interaction.response.is_done():
+        await interaction.response.defer(ephemeral=True)
+        if timer is not None:
+            timer.deferred = True
+    return await task
+
+
+async def respond(interaction, *args, **kwargs):
+    """尚未响应时一次 send_message 完成；已经 defer 过则走 followup。"""
+    kwargs.setdefault("ephemeral", True)
+    if interaction.response.is_done():
+        return await interaction.followup.send(*args, **kwargs)
+    return await interaction.response.send_message(*args, **kwargs)
+
+
+# ================= 分页选项缓存 =================
+# 下拉菜单每页的 SelectOption 预先构建好，按数据版本缓存；翻页只按页码取出现成的一页，
+# 只有条目增删改（版本变化）后第一次打开菜单时才重建。
+
+PAGE_SIZE = 25
+
+
+class OptionPages:
+    """entries 为 (标签, 值) 序列，按 PAGE_SIZE 切成若干页。"""
+
+    __slots__ = ("pages", "count")
+
+    def __init__(self, entries, page_size=PAGE_SIZE):
+        options = [discord.SelectOption(label=label, value=value) for label, value in entries]
+        self.pages = [tuple(options[i:i + page_size]) for i in range(0, len(options), page_size)]
+        self.count = len(options)
+
+    def __len__(self):
+        """总页数（没有条目时也算一页）。"""
+        return max(1, len(self.pages))
+
+    def page(self, page):
+        """返回 (校正后的页码, 该页选项)。"""
+        page = max(0, min(page, len(self) - 1))
+        return page, (self.pages[page] if self.pages else ())
+
+
+class PageCache:
+    def __init__(self):
+        self._pages = {}
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, key, version, entries):
+        """version 与缓存一致时直接返回；否则调用 entries() 取得 (标签, 值) 并重建。"""
+        cached = self._pages.get(key)
+        # 版本可以是计数器，也可以是不可变的数据本身（未改动时是同一个对象，is 即可判断）
+        if cached is not None and (cached[0] is version or cached[0] == version):
+            self.hits += 1
+            return cached[1]
+        self.builds += 1
+        pages = OptionPages(entries())
+        self._pages[key] = (version, pages)
+        return pages
+
+    def invalidate(self, key):
+        self._pages.pop(key, None)
+
+    def __len__(self):
+        return len(self._pages)
+
+
+def paged_select(pages, page, select_id, page_id, placeholder, empty_label):
+    """用缓存的一页选项组装菜单，返回 (实际页码, 视图)；page_id(页码) 生成翻页按钮的 custom_id。"""
+    page, options = pages.page(page)
+    total = len(pages)
+    select = discord.ui.Select(
+        custom_id=select_id,
+        placeholder=placeholder,
+        min_values=1,
+        max_values=1,
+        options=list(options) or [discord.SelectOption(label=empty_label, value="-1", default=True)],
+        disabled=not options,
+    )
+    prev_btn = discord.ui.Button(label="⬅️ 上一页", style=discord.ButtonStyle.secondary, row=1,
+                                 custom_id=page_id(page - 1), disabled=page <= 0)
+    next_btn = discord.ui.Button(label="下一页 ➡️", style=discord.ButtonStyle.secondary, row=1,
+                                 custom_id=page_id(page + 1), disabled=page >= total - 1)
+    return page, frozen_view(select, prev_btn, next_btn)
+
+
+def install(bot):
+    bot.add_listener(dispatch, "on_interaction")
@@ -0,0 +1,74 @@
+# metrics.py
+
+import bisect
+import time
+from contextlib import contextmanager
+
+# ================= 延迟直方图 =================
+
+# 桶边界（毫秒），最后一个桶收集所有更慢的请求
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LatencyHistogram:
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        """按桶估算分位数（返回所在桶的上界，毫秒）。"""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.bounds[i]) if i < len(self.bounds) else self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        if not self.count:
+            return "暂无数据"
+        avg = self.total_ms / self.count
+        return (
+            f"{self.count} 次 | 平均 {avg:.0f}ms | "
+            f"P50 ≤{self.percentile(50):.0f}ms | P99 ≤{self.percentile(99):.0f}ms | 最大 {self.max_ms:.0f}ms"
+        )
+
+
+# ================= 交互响应耗时 =================
+# 按路径统计从回调开始到回调结束的耗时；先 defer 再 followup 的请求单独归类，便于对比。
+
+interaction_latency = {}
+
+
+class _Timer:
+    __slots__ = ("deferred",)
+
+    def __init__(self):
+        self.deferred = False
+
+
+@contextmanager
+def timed(path):
+    timer = _Timer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        key = f"{path}（defer）" if timer.deferred else path
+        hist = interaction_latency.get(key)
+        if hist is None:
+            hist = interaction_latency[key] = LatencyHistogram()
+        hist.observe(time.perf_counter() - start)
@@ -0,0 +1,326 @@
+# migrate.py
+
+import asyncio
+import json
+import os
+import time
+
+from utils.ratelimit import RateLimitObserver, observe_rate_limits
+
+# ================= 批量身份组迁移引擎 =================
+# 多个 worker 并行处理成员，并发上限按响应头里的限速信息自适应调整（AIMD）：
+# 连续成功时逐步增加并发，收到 429 时并发减半，并让所有 worker 一起暂停到桶重置。
+# 注意：py-cord 对同一路由桶的请求本身就是串行发出的，多出来的 worker 的作用是
+# 让下一个请求随时就绪，把桶的额度吃满，而不是绕过限速。
+
+
+class Preset:
+    __slots__ = ("name", "icon", "workers", "max_workers", "interval", "expected_rate")
+
+    def __init__(self, name, icon, workers, max_workers, interval, expected_rate):
+        self.name = name
+        self.icon = icon
+        self.workers = workers          # 初始并发
+        self.max_workers = max_workers  # 并发上限
+        self.interval = interval        # 每个 worker 每次请求后的固定间隔（秒）
+        self.expected_rate = expected_rate  # 预估吞吐（人/秒），用于预演时估算耗时
+
+
+PRESETS = {
+    # 与旧版一致：逐个处理，每人之后休息 0.5 秒
+    "稳重": Preset("稳重", "🐢", workers=1, max_workers=1, interval=0.5, expected_rate=1.5),
+    "标准": Preset("标准", "🚶", workers=2, max_workers=4, interval=0.0, expected_rate=4.0),
+    "极速": Preset("极速", "🚀", workers=4, max_workers=10, interval=0.0, expected_rate=8.0),
+}
+DEFAULT_PRESET = "标准"
+
+# 连续成功多少次后并发 +1
+INCREASE_AFTER = 10
+# 待处理队列的长度上限（流式模式下生产者最多领先这么多人）
+STREAM_BUFFER = 1000
+
+_END = object()
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class MigrationEngine:
+    def __init__(self, action, preset=DEFAULT_PRESET, bucket=None):
+        self.action = action
+        self.preset = PRESETS[preset]
+        # 多个任务共享的全局令牌桶（可选）
+        self.bucket = bucket
+        self.stopped = False
+        self.limit = self.preset.workers
+        self.observer = RateLimitObserver()
+        self.total = 0
+        self.done = 0
+        self.success = 0
+        self.failed = 0
+        self.backoffs = 0
+        self.started = None
+        self._active = 0
+        self._streak = 0
+        self._seen_throttled = 0
+        self._resume_at = 0.0
+        self._cond = None
+        self._queue = None
+        self._producer = None
+        self.fed = 0            # 已送入队列的人数（流式模式下即“已发现”的人数）
+        self.error = None       # 拉取成员失败时的异常
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    @property
+    def finished(self):
+        """成员已全部处理完（没有被暂停/取消，拉取也没有出错）。"""
+        return not self.stopped and self.error is None
+
+    @property
+    def rate(self):
+        """每秒处理人数。"""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def stop(self):
+        """让 worker 处理完手上的成员后退出（暂停 / 取消任务时使用）。"""
+        self.stopped = True
+        if self._producer:
+            self._producer.cancel()
+        if self._queue:
+            try:
+                # 唤醒正在等待下一位成员的 worker
+                self._queue.put_nowait(_END)
+            except asyncio.QueueFull:
+                pass
+
+    async def run(self, members, on_progress=None):
+        """并发处理 members，on_progress(engine) 在每处理完一人后调用。
+
+        members 可以是列表，也可以是异步迭代器（流式模式：边拉取边处理，总数未知）。
+        """
+        if hasattr(members, "__aiter__"):
+            self.total = None
+        else:
+            members = list(members)
+            self.total = len(members)
+            members = _aiter(members)
+        self.started = time.monotonic()
+        self._cond = asyncio.Condition()
+        # 有界队列：生产者最多领先 STREAM_BUFFER 人，内存占用与服务器规模无关
+        self._queue = asyncio.Queue(maxsize=max(STREAM_BUFFER, self.preset.max_workers * 2))
+
+        with observe_rate_limits(self.observer):
+            self._producer = asyncio.create_task(self._produce(members))
+            workers = [
+                asyncio.create_task(self._worker(on_progress))
+                for _ in range(self.preset.max_workers)
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                self._producer.cancel()
+                for worker in workers:
+                    worker.cancel()
+        return self
+
+    async def _produce(self, members):
+        try:
+            async for member in members:
+                self.fed += 1
+                await self._queue.put(member)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+            print(f"⚠️ 拉取成员失败: {e}")
+        await self._queue.put(_END)
+
+    async def _worker(self, on_progress):
+        while True:
+            async with self._cond:
+                # 超出当前并发上限的 worker 在这里等待
+                await self._cond.wait_for(lambda: self._active < self.limit or self.stopped)
+                if self.stopped:
+                    return
+                self._active += 1
+
+            member = await self._queue.get()
+            if member is _END or self.stopped:
+                if member is _END:
+                    # 放回结束标记，让其他 worker 也能退出
+                    self._queue.put_nowait(_END)
+                async with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+                return
+
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.bucket:
+                await self.bucket.acquire()
+
+            try:
+                await self.action(member)
+                self.success += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"操作 {getattr(member, 'name', member)} 失败: {e}")
+            finally:
+                self.done += 1
+                self._adapt()
+                async with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+            if on_progress:
+                try:
+                    await on_progress(self)
+                except Exception:
+                    pass  # 进度更新失败不影响主流程
+
+            if self.preset.interval:
+                await asyncio.sleep(self.preset.interval)
+
+    def _adapt(self):
+        observer = self.observer
+        if observer.throttled > self._seen_throttled:
+            # 被限速：并发减半，所有 worker 暂停到桶重置
+            self._seen_throttled = observer.throttled
+            self.limit = max(1, self.limit // 2)
+            self._streak = 0
+            self.backoffs += 1
+            pause = max(observer.retry_after, observer.reset_after)
+            self._resume_at = max(self._resume_at, time.monotonic() + pause)
+            return
+
+        if observer.remaining == 0:
+            # 桶已见底，先不加并发，py-cord 会等到重置再放行
+            self._streak = 0
+            return
+
+        self._streak += 1
+        if self._streak >= INCREASE_AFTER and self.limit < self.preset.max_workers:
+            self.limit += 1
+            self._streak = 0
+
+
+# ================= 迁移任务持久化 =================
+# 每个任务记录已处理 / 失败的成员 id；重启后跳过这些成员继续执行。
+#   migration_jobs.json      全量快照（状态变化时整体重写）
+#   migration_jobs.json.log  运行中的检查点：每行只追加自上次以来新增的成员 id，
+#                            写入量与任务规模无关；下次全量保存时清空
+# 快照和日志各带一个代号，代号不一致的日志行（快照已包含）在加载时忽略。
+
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+
+STATUS_NAMES = {
+    RUNNING: "运行中",
+    PAUSED: "已暂停",
+    CANCELLED: "已取消",
+    DONE: "已完成",
+}
+
+# 最多保留多少个已结束的任务记录
+KEEP_FINISHED = 20
+
+
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.jobs = {}
+        self.next_id = 1
+        self.generation = 0
+        # job_id -> (已写入磁盘的 processed 数, failed 数)
+        self._flushed = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            self.jobs = raw.get("jobs", {})
+            for job in self.jobs.values():
+                # 早期任务没有保存描述文字
+                job.setdefault("summary", f"<@&{job.get('source_role_id')}> -> <@&{job.get('target_role_id')}>")
+            self.next_id = raw.get("next_id", len(self.jobs) + 1)
+            self.generation = raw.get("generation", 0)
+        except Exception as e:
+            print(f"⚠️ 迁移任务加载失败: {e}")
+        self._replay_log()
+
+    def _replay_log(self):
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 最后一行可能在写入途中断电，截断的记录直接丢弃
+                        continue
+                    job = self.jobs.get(record.get("id"))
+                    if job is None or record.get("gen") != self.generation:
+                        continue
+                    job["processed"].extend(record["processed"])
+                    job["failed"].extend(record["failed"])
+                    job["elapsed"] = record.get("elapsed", job.get("elapsed", 0))
+        self._flushed = {job_id: (len(j["processed"]), len(j["failed"])) for job_id, j in self.jobs.items()}
+
+    def checkpoint(self, job):
+        """只追加新增的成员 id，供运行中定期调用；耗时不随任务变大而增长。"""
+        done, failed = self._flushed.get(job["id"], (0, 0))
+        record = {
+            "gen": self.generation,
+            "id": job["id"],
+            "processed": job["processed"][done:],
+            "failed": job["failed"][failed:],
+            "elapsed": job.get("elapsed", 0),
+        }
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        self._flushed[job["id"]] = (len(job["processed"]), len(job["failed"]))
+
+    def create(self, **fields):
+        job_id = str(self.next_id)
+        self.next_id += 1
+        job = {
+            "id": job_id,
+            "status": RUNNING,
+            "created": time.time(),
+            "processed": [],
+            "failed": [],
+            **fields,
+        }
+        self.jobs[job_id] = job
+        self.save()
+        return job
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if j["status"] in (DONE, CANCELLED)]
+        finished.sort(key=lambda j: j["created"])
+        for job in finished[:-KEEP_FINISHED]:
+            del self.jobs[job["id"]]
+
+    def save(self):
+        """全量保存（状态变化时调用），之后检查点日志作废。"""
+        self._prune()
+        self.generation += 1
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"next_id": self.next_id, "generation": self.generation, "jobs": self.jobs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self._flushed = {job_id: (len(j["processed"]), len(j["failed"])) for job_id, j in self.jobs.items()}
@@ -0,0 +1,105 @@
+# persistence.py
+
+import threading
+import time
+
+# ================= 写回缓存 (write-behind) =================
+# 事件循环里只做“标脏”，真正的落盘由后台线程按间隔合并执行。
+
+
+class WriteBehindWriter:
+    def __init__(self, storage, interval=1.0, channels=None):
+        """channels 为启动时已加载的全部频道，用作镜像的初始内容。"""
+        self.storage = storage
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        # 全部频道的最新快照：{cid: config}，以及本轮变化的频道 ID。
+        # 镜像必须完整：JSON 后端每次提交都按它整份重写文件
+        self._mirror = dict(channels or {})
+        self._pending = set()
+        self._full = False
+        self.stats = {
+            "marks": 0,
+            "flushes": 0,
+            "written": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="panel-writer", daemon=True)
+        self._thread.start()
+
+    def mark(self, channels, changed=None):
+        """记录变化（不落盘）。changed 为 None 表示整份重写。"""
+        with self._lock:
+            if changed is None:
+                self._mirror = dict(channels)
+                self._full = True
+                self.stats["marks"] += 1
+                return
+            for cid in changed:
+                cid = str(cid)
+                config = channels.get(cid)
+                if config is None:
+                    self._mirror.pop(cid, None)
+                else:
+                    self._mirror[cid] = config
+                self._pending.add(cid)
+                self.stats["marks"] += 1
+
+    def flush(self):
+        """把当前积压的变化一次性写入后端（调用线程同步执行）。"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._full:
+                    return
+                changed = None if self._full else self._pending
+                snapshot = dict(self._mirror)
+                self._pending = set()
+                self._full = False
+
+            started = time.perf_counter()
+            try:
+                self.storage.commit(snapshot, changed)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ 面板数据落盘失败，稍后重试: {e}")
+                with self._lock:
+                    if changed is None:
+                        self._full = True
+                    else:
+                        self._pending |= changed
+                return
+
+            cost = (time.perf_counter() - started) * 1000
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(snapshot) if changed is None else len(changed)
+            self.stats["last_flush_ms"] = cost
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], cost)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """停止后台线程并做最后一次落盘（关机时调用）。"""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(timeout=max(5.0, self.interval * 2))
+        self.flush()
+        self.storage.close()
+
+    def metrics(self):
+        stats = dict(self.stats)
+        # 被合并掉的写入次数 = 标脏次数 - 实际写入的频道数
+        stats["coalesced"] = max(0, stats["marks"] - stats["written"])
+        with self._lock:
+            stats["pending"] = len(self._mirror) if self._full else len(self._pending)
+        return stats
@@ -0,0 +1,171 @@
+# priority.py
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+from discord.webhook.async_ import async_context
+
+from utils import ratelimit
+from utils.metrics import LatencyHistogram
+
+# ================= 出站请求优先级调度 =================
+# 数值越小优先级越高。交互响应/后续消息永远优先；批量身份组操作在有更高优先级的
+# 请求排队或交互响应进行中时让路。
+# 名额只在真正发出 HTTP 请求期间占用（通过 aiohttp 的 TraceConfig 在发送前申请、
+# 收到响应后归还）；py-cord 内部的路由桶等待和 429 重试间隔都不占名额，
+# 被限速的批量请求不会把名额全部占住。
+
+INTERACTION = 0
+DEFAULT = 1
+REFRESH = 2
+BULK = 3
+
+CLASS_NAMES = {
+    INTERACTION: "交互响应",
+    DEFAULT: "默认",
+    REFRESH: "面板刷新",
+    BULK: "批量身份组",
+}
+
+request_class = ContextVar("ivory_request_class", default=DEFAULT)
+
+
+@contextmanager
+def api_priority(cls):
+    """在此范围内发出的 API 请求都归入指定优先级。"""
+    token = request_class.set(cls)
+    try:
+        yield
+    finally:
+        request_class.reset(token)
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrency=8, bulk_reserve=2):
+        self.max_concurrency = max_concurrency
+        # 给高优先级请求预留的并发名额，批量任务不能占用
+        self.bulk_reserve = bulk_reserve
+        self._active = {cls: 0 for cls in CLASS_NAMES}
+        self._waiters = []   # [(cls, seq, future)]
+        self._seq = itertools.count()
+        self.wait_hist = {cls: LatencyHistogram() for cls in CLASS_NAMES}
+        self.latency_hist = {cls: LatencyHistogram() for cls in CLASS_NAMES}
+
+    def _total_active(self):
+        return sum(self._active.values())
+
+    def _can_admit(self, cls):
+        if cls == INTERACTION:
+            return True
+        total = self._total_active()
+        if cls == BULK:
+            if self._active[INTERACTION] > 0:
+                return False
+            return total < self.max_concurrency - self.bulk_reserve
+        return total < self.max_concurrency
+
+    def _head(self):
+        """优先级最高且仍在等待的请求类别；已取消的等待者顺便丢弃。"""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        return self._waiters[0][0] if self._waiters else None
+
+    def _wake(self):
+        while self._waiters:
+            cls, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(cls):
+                # 队首（优先级最高）都进不去，后面的更低优先级也必须等待
+                break
+            heapq.heappop(self._waiters)
+            self._active[cls] += 1
+            future.set_result(None)
+
+    async def acquire(self, cls):
+        head = self._head()
+        has_better_waiter = head is not None and head <= cls
+        if self._can_admit(cls) and not has_better_waiter:
+            self._active[cls] += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (cls, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分到名额却被取消，归还名额
+                self.release(cls)
+            raise
+
+    def release(self, cls):
+        self._active[cls] -= 1
+        self._wake()
+
+    def wrap(self, request, fixed_cls=None):
+        """记录端到端耗时（含 py-cord 的限速等待）；fixed_cls 固定该入口发出请求的类别。"""
+        async def scheduled_request(*args, **kwargs):
+            token = request_class.set(fixed_cls) if fixed_cls is not None else None
+            cls = request_class.get()
+            started = time.perf_counter()
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                self.latency_hist[cls].observe(time.perf_counter() - started)
+                if token is not None:
+                    request_class.reset(token)
+
+        return scheduled_request
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.cls = request_class.get()
+        ctx.held = False
+        queued_at = time.perf_counter()
+        await self.acquire(ctx.cls)
+        ctx.held = True
+        self.wait_hist[ctx.cls].observe(time.perf_counter() - queued_at)
+
+    async def _on_request_done(self, session, ctx, params):
+        if getattr(ctx, "held", False):
+            ctx.held = False
+            self.release(ctx.cls)
+
+    def trace_config(self):
+        """只在单次 HTTP 发送期间占用名额的 TraceConfig。"""
+        config = aiohttp.TraceConfig()
+        config.on_request_start.append(self._on_request_start)
+        config.on_request_end.append(self._on_request_done)
+        config.on_request_exception.append(self._on_request_done)
+        config.freeze()
+        return config
+
+    def snapshot(self):
+        return {
+            cls: {
+                "active": self._active[cls],
+                "waiting": sum(1 for c, _, f in self._waiters if c == cls and not f.done()),
+                "wait": self.wait_hist[cls],
+                "latency": self.latency_hist[cls],
+            }
+            for cls in CLASS_NAMES
+        }
+
+
+scheduler = RequestScheduler()
+
+
+def install(bot):
+    """把 Bot 的 HTTP 客户端与交互 webhook 适配器接入优先级调度。
+
+    名额由挂在 HTTP 会话上的 TraceConfig 控制，需要配合 ratelimit.install_tracing。
+    """
+    ratelimit.add_trace_config(scheduler.trace_config())
+    bot.http.request = scheduler.wrap(bot.http.request)
+    adapter = async_context.get()
+    adapter.request = scheduler.wrap(adapter.request, fixed_cls=INTERACTION)
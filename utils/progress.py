@@ -0,0 +1,134 @@
+# progress.py
+
+import asyncio
+import time
+from collections import deque
+
+import discord
+
+# ================= 长任务进度汇报 =================
+# 处理方只调用 update()（很便宜），由后台循环按固定间隔决定要不要真正发送：
+# 进度没有变化就跳过，一个间隔内最多一次编辑，避免刷屏消耗限速额度。
+
+DEFAULT_INTERVAL = 3.0
+# 速率按最近多少次采样计算（采样间隔即 interval）
+RATE_SAMPLES = 10
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}秒"
+    if seconds < 3600:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds // 3600}小时{seconds % 3600 // 60}分"
+
+
+async def print_progress(text):
+    """控制台输出，作为没有进度消息时的 send。"""
+    print(text)
+
+
+class ProgressReporter:
+    def __init__(self, send, render, interval=DEFAULT_INTERVAL, total=None, done=0):
+        """send(内容) 负责发送/编辑，render(reporter) 生成内容（Embed 或字符串）。
+
+        done 是开始时已完成的数量（续跑的任务），不计入速率。
+        """
+        self.send = send
+        self.render = render
+        self.interval = interval
+        self.total = total
+        self.done = done
+        self._initial = done
+        self._extra = None
+        self.started = time.monotonic()
+        self._samples = deque(maxlen=RATE_SAMPLES)
+        self._sent_state = None
+        self._task = None
+        self.stopped = False
+        self.edits = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def update(self, done, total=None, extra=None):
+        """extra：除完成数外其他会显示出来的状态（如已扫描人数），变化时同样需要刷新。"""
+        self.done = done
+        if total is not None:
+            self.total = total
+        self._extra = extra
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """最近一段时间的吞吐（单位/秒），刚开始时按总平均计算。"""
+        if len(self._samples) >= 2:
+            (t0, d0), (t1, d1) = self._samples[0], self._samples[-1]
+            if t1 > t0:
+                return (d1 - d0) / (t1 - t0)
+        elapsed = self.elapsed
+        return (self.done - self._initial) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """预计剩余秒数；总数未知或还没有速率时为 None。"""
+        if self.total is None:
+            return None
+        rate = self.rate
+        if rate <= 0:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def eta_text(self):
+        eta = self.eta
+        return "计算中..." if eta is None else f"约 {format_duration(eta)}"
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def _loop(self):
+        while not self.stopped:
+            await asyncio.sleep(self.interval)
+            self._samples.append((time.monotonic(), self.done))
+            await self.flush()
+
+    async def flush(self, force=False):
+        state = (self.done, self.total, self._extra)
+        if not force and state == self._sent_state:
+            # 进度没有变化（只有耗时在走），不值得一次编辑
+            self.skipped += 1
+            return
+        try:
+            await self.send(self.render(self))
+            self._sent_state = state
+            self.edits += 1
+        except discord.NotFound:
+            # 进度消息已被删除，之后不再尝试
+            print("⚠️ 进度消息已不存在，停止汇报")
+            self.stopped = True
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ 进度更新失败: {e}")
+
+    async def finish(self, final=None):
+        """停止定时汇报；给出 final 时发送最终内容，否则补发一次最新进度。"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.stopped:
+            return
+        self.stopped = True
+        if final is not None:
+            try:
+                await self.send(final)
+                self.edits += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ 进度更新失败: {e}")
+        else:
+            await self.flush()
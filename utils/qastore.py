@@ -0,0 +1,185 @@
+# qastore.py
+
+import json
+import mmap
+import os
+from collections.abc import MutableMapping
+
+# ================= 答疑库存储 =================
+# 标题表常驻内存，回答正文放在只追加的正文文件里，通过内存映射按需读取：
+#   qa_index.json  {"titles": [[标题, 偏移, 长度, id], ...], "garbage": 失效字节数, "next_id": 下一个 id}
+#   qa_bodies.bin  UTF-8 正文依次拼接
+# 修改/删除只会在正文文件末尾追加或留下失效字节，失效部分过多时整体压缩。
+# 每个条目有一个稳定的整数 id（改正文、rename 改标题都不变，删除后不复用），菜单里用 id 代替标题或位置。
+
+COMPACT_MIN_BYTES = 64 * 1024
+
+
+class LazyQAStore(MutableMapping):
+    def __init__(self, body_path, index_path):
+        self.body_path = body_path
+        self.index_path = index_path
+        self._index = {}        # 标题 -> (偏移, 长度)
+        self._ids = {}          # 标题 -> id
+        self._titles = {}       # id -> 标题
+        self._next_id = 1
+        self._garbage = 0
+        self._size = 0
+        self._file = None
+        self._map = None
+        # 标题列表的版本：增删标题（或整体替换）时递增，供菜单等缓存判断是否过期
+        self.version = 0
+        self._load_index()
+
+    # ---------- 读取 ----------
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                self._index = {}
+                for title, offset, length, *rest in raw.get("titles", []):
+                    self._index[title] = (offset, length)
+                    if rest:
+                        self._ids[title] = rest[0]
+                self._garbage = raw.get("garbage", 0)
+                self._next_id = raw.get("next_id", max(self._ids.values(), default=0) + 1)
+            except Exception as e:
+                print(f"⚠️ 答疑索引加载失败: {e}")
+                self._index = {}
+        self._size = os.path.getsize(self.body_path) if os.path.exists(self.body_path) else 0
+        # 正文文件比索引记录的短（例如被截断），丢弃越界的条目
+        self._index = {t: (o, n) for t, (o, n) in self._index.items() if o + n <= self._size}
+        self._sync_ids()
+
+    def _sync_ids(self):
+        """丢弃已不存在的标题的 id，给没有 id 的标题分配新 id。"""
+        self._ids = {t: i for t, i in self._ids.items() if t in self._index}
+        for title in self._index:
+            if title not in self._ids:
+                self._ids[title] = self._next_id
+                self._next_id += 1
+        self._titles = {i: t for t, i in self._ids.items()}
+
+    def _mapped(self):
+        if self._map is None:
+            if self._size == 0:
+                return b""
+            self._file = open(self.body_path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _unmap(self):
+        # 写文件前先解除映射（Windows 下映射中的文件无法替换）
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getitem__(self, title):
+        offset, length = self._index[title]
+        return self._mapped()[offset:offset + length].decode("utf-8")
+
+    def __contains__(self, title):
+        return title in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def entry_id(self, title):
+        return self._ids.get(title)
+
+    def title_of(self, entry_id):
+        """按 id 查标题；条目已删除时返回 None。"""
+        return self._titles.get(entry_id)
+
+    # ---------- 写入 ----------
+
+    def __setitem__(self, title, body):
+        data = body.encode("utf-8")
+        self._unmap()
+        with open(self.body_path, "ab") as f:
+            f.write(data)
+        old = self._index.get(title)
+        if old is not None:
+            self._garbage += old[1]
+        else:
+            self.version += 1
+            self._ids[title] = self._next_id
+            self._titles[self._next_id] = title
+            self._next_id += 1
+        self._index[title] = (self._size, len(data))
+        self._size += len(data)
+
+    def __delitem__(self, title):
+        _, length = self._index.pop(title)
+        self._garbage += length
+        self.version += 1
+        self._titles.pop(self._ids.pop(title), None)
+
+    def rename(self, old_title, new_title):
+        """改标题：id 和正文位置不变，条目在列表中的顺序也不变。"""
+        if new_title == old_title:
+            return
+        if new_title in self._index:
+            raise KeyError(new_title)
+        self._index = {(new_title if t == old_title else t): loc for t, loc in self._index.items()}
+        entry_id = self._ids.pop(old_title)
+        self._ids[new_title] = entry_id
+        self._titles[entry_id] = new_title
+        self.version += 1
+
+    def replace_all(self, entries):
+        """用新的 {标题: 正文} 整体替换（导入 / 重置时使用）。"""
+        self._write_bodies((title, body.encode("utf-8")) for title, body in entries.items())
+        self.save()
+
+    def clear(self):
+        self.replace_all({})
+
+    def _write_bodies(self, items):
+        self._unmap()
+        tmp_path = f"{self.body_path}.tmp"
+        index = {}
+        offset = 0
+        with open(tmp_path, "wb") as f:
+            for title, data in items:
+                f.write(data)
+                index[title] = (offset, len(data))
+                offset += len(data)
+        os.replace(tmp_path, self.body_path)
+        self._index = index
+        self._sync_ids()
+        self.version += 1
+        self._size = offset
+        self._garbage = 0
+
+    def compact(self):
+        mapped = self._mapped()
+        items = [(title, bytes(mapped[o:o + n])) for title, (o, n) in self._index.items()]
+        self._write_bodies(items)
+
+    def save(self):
+        if self._garbage > COMPACT_MIN_BYTES and self._garbage * 2 > self._size:
+            self.compact()
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "titles": [[t, o, n, self._ids[t]] for t, (o, n) in self._index.items()],
+                    "garbage": self._garbage,
+                    "next_id": self._next_id,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self._unmap()
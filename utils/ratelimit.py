@@ -0,0 +1,220 @@
+# ratelimit.py
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+
+# ================= 令牌桶 =================
+
+
+class TokenBucket:
+    """经典令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """距离攒够 tokens 个令牌还需要多少秒。"""
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        # 加锁保证等待者按先来后到取令牌
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+
+# ================= 按键限流 =================
+# 每个键（如 (用户, 频道)）一个令牌桶，只存 (令牌数, 更新时间)。
+# 空闲到令牌回满的桶与新桶等价，定期清理掉，内存只与活跃用户数相关。
+
+SWEEP_EVERY = 1024
+
+
+class KeyedRateLimiter:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._calls = 0
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            ok = True
+        else:
+            self._buckets[key] = (tokens, now)
+            self.rejected += 1
+            ok = False
+
+        self._calls += 1
+        if self._calls % SWEEP_EVERY == 0:
+            self.sweep(now)
+        return ok
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        refill = self.capacity / self.rate
+        idle = [k for k, (tokens, updated) in self._buckets.items() if now - updated >= refill]
+        for key in idle:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# 组件名 -> 限流器，供运行状态统一展示
+limiters = {}
+# 被限流时回复给用户的提示
+THROTTLE_MESSAGE = "⏳ 操作太频繁，请稍后再试。"
+
+
+def component_limiter(name, rate, capacity):
+    limiter = limiters.get(name)
+    if limiter is None:
+        limiter = limiters[name] = KeyedRateLimiter(rate, capacity)
+    return limiter
+
+
+# ================= 限速响应头观测 =================
+# 通过 aiohttp 的 TraceConfig 读取每个响应的 X-RateLimit-* 头。
+# 只有在 observe_rate_limits() 范围内发出的请求才会被记录，互不干扰。
+
+rate_observer = ContextVar("ivory_rate_observer", default=None)
+
+
+class RateLimitObserver:
+    def __init__(self):
+        self.bucket = None
+        self.limit = None
+        self.remaining = None
+        self.reset_after = 0.0
+        self.responses = 0
+        self.throttled = 0       # 收到的 429 次数
+        self.retry_after = 0.0   # 最近一次 429 要求等待的秒数
+
+    def record(self, status, headers):
+        self.responses += 1
+        bucket = headers.get("X-RateLimit-Bucket")
+        if bucket:
+            self.bucket = bucket
+        try:
+            if "X-RateLimit-Limit" in headers:
+                self.limit = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Remaining" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+            if "X-RateLimit-Reset-After" in headers:
+                self.reset_after = float(headers["X-RateLimit-Reset-After"])
+        except ValueError:
+            pass
+        if status == 429:
+            self.throttled += 1
+            try:
+                self.retry_after = float(headers.get("Retry-After") or self.reset_after or 1.0)
+            except ValueError:
+                self.retry_after = 1.0
+
+
+@contextmanager
+def observe_rate_limits(observer):
+    token = rate_observer.set(observer)
+    try:
+        yield observer
+    finally:
+        rate_observer.reset(token)
+
+
+async def _on_request_end(session, ctx, params):
+    observer = rate_observer.get()
+    if observer is not None:
+        observer.record(params.response.status, params.response.headers)
+
+
+def _trace_config():
+    config = aiohttp.TraceConfig()
+    config.on_request_end.append(_on_request_end)
+    config.freeze()
+    return config
+
+
+_TRACE_CONFIG = _trace_config()
+# 要挂到 Bot HTTP 会话上的全部 TraceConfig（其他模块可通过 add_trace_config 追加）
+_trace_configs = [_TRACE_CONFIG]
+
+
+def add_trace_config(config):
+    if config not in _trace_configs:
+        _trace_configs.append(config)
+
+
+def install_tracing(http):
+    """给 Bot 的 HTTP 会话挂上限速观测。会话在登录（或重建）时才创建，所以包装这两个入口。
+
+    会话是 py-cord 的私有属性，找不到时只打印提示、不影响 Bot 运行。返回是否安装成功。
+    """
+
+    def session_configs():
+        # 登录前会话是 MISSING 占位；私有属性名随 py-cord 版本变化时同样拿不到
+        configs = getattr(getattr(http, "_HTTPClient__session", None), "trace_configs", None)
+        return configs if isinstance(configs, list) else None
+
+    def attach():
+        configs = session_configs()
+        if configs is None:
+            print("⚠️ 未找到 Bot 的 HTTP 会话，限速观测与请求优先级调度未生效")
+            return
+        for config in _trace_configs:
+            if config not in configs:
+                configs.append(config)
+
+    original_login = getattr(http, "static_login", None)
+    original_recreate = getattr(http, "recreate", None)
+    if original_login is None:
+        print("⚠️ 当前 py-cord 的 HTTPClient 没有 static_login，限速观测未安装")
+        return False
+
+    async def static_login(*args, **kwargs):
+        try:
+            return await original_login(*args, **kwargs)
+        finally:
+            attach()
+
+    http.static_login = static_login
+    if original_recreate is not None:
+        def recreate():
+            original_recreate()
+            attach()
+
+        http.recreate = recreate
+    else:
+        print("⚠️ 当前 py-cord 的 HTTPClient 没有 recreate，会话重建后限速观测将失效")
+    if session_configs() is not None:
+        # 已经登录过：直接挂上
+        attach()
+    return True
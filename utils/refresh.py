@@ -0,0 +1,247 @@
+# refresh.py
+
+import asyncio
+import heapq
+import time
+from collections import deque
+
+# ================= 面板刷新调度 =================
+
+
+class RefreshScheduler:
+    """单循环刷新调度器：每个频道只有一个截止时间，新消息只是把截止时间往后推。
+
+    堆中每个频道至多一项；弹出时若发现截止时间已被推后，就按新时间重新入堆。
+    """
+
+    def __init__(self, callback, delay=4.0, max_wait=30.0):
+        self.callback = callback
+        self.delay = delay
+        self.max_wait = max_wait
+        self._heap = []          # [(heap_deadline, cid)]
+        self._in_heap = set()
+        self._deadline = {}      # cid -> 实际截止时间
+        self._first_seen = {}    # cid -> 本轮第一次请求的时间（用于最长等待）
+        self._channels = {}      # cid -> channel
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+        self.fired = 0
+        self.touches = 0
+
+    def touch(self, channel):
+        """登记（或推迟）一次刷新，O(log n)。"""
+        cid = channel.id
+        now = time.monotonic()
+        first = self._first_seen.setdefault(cid, now)
+        deadline = min(now + self.delay, first + self.max_wait)
+
+        self._deadline[cid] = deadline
+        self._channels[cid] = channel
+        self.touches += 1
+
+        if cid not in self._in_heap:
+            heapq.heappush(self._heap, (deadline, cid))
+            self._in_heap.add(cid)
+            if self._heap[0][1] == cid:
+                self._wakeup.set()
+
+        self._ensure_running()
+
+    def cancel(self, cid):
+        self._deadline.pop(cid, None)
+        self._first_seen.pop(cid, None)
+        self._channels.pop(cid, None)
+
+    def pending(self):
+        """返回 [(cid, 剩余秒数)]，按截止时间排序。"""
+        now = time.monotonic()
+        return sorted(
+            ((cid, max(0.0, deadline - now)) for cid, deadline in self._deadline.items()),
+            key=lambda item: item[1],
+        )
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            heap_deadline, cid = self._heap[0]
+            deadline = self._deadline.get(cid)
+
+            if deadline is None:
+                # 已取消
+                heapq.heappop(self._heap)
+                self._in_heap.discard(cid)
+                continue
+
+            if deadline > heap_deadline:
+                # 截止时间被推后了，按新时间重新排队
+                heapq.heapreplace(self._heap, (deadline, cid))
+                continue
+
+            delta = deadline - time.monotonic()
+            if delta > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delta)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._in_heap.discard(cid)
+            del self._deadline[cid]
+            self._first_seen.pop(cid, None)
+            channel = self._channels.pop(cid)
+            self.fired += 1
+
+            # 只有真正到期的刷新才会创建任务，消息本身不再产生任务
+            task = asyncio.create_task(self.callback(channel))
+            self._running.add(task)
+            task.add_done_callback(self._on_done)
+
+    def _on_done(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"⚠️ 定时刷新失败: {task.exception()}")
+
+
+IDLE = "idle"
+RUNNING = "running"
+RUNNING_DIRTY = "running+dirty"
+
+
+class CoalescingRunner:
+    """每个频道一个状态机：空闲 / 运行中 / 运行中且有新请求。
+
+    运行期间到来的任意多次请求都会合并成恰好一次后续执行，不丢更新也不重复调用。
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._state = {}
+        self._latest = {}
+        self.stats = {"requests": 0, "runs": 0, "coalesced": 0}
+
+    def state(self, cid):
+        return self._state.get(cid, IDLE)
+
+    def states(self):
+        return dict(self._state)
+
+    async def request(self, channel):
+        cid = channel.id
+        self.stats["requests"] += 1
+
+        if self._state.get(cid, IDLE) != IDLE:
+            if self._state[cid] == RUNNING_DIRTY:
+                self.stats["coalesced"] += 1
+            self._state[cid] = RUNNING_DIRTY
+            self._latest[cid] = channel
+            return False
+
+        self._state[cid] = RUNNING
+        try:
+            while True:
+                self.stats["runs"] += 1
+                try:
+                    await self.worker(channel)
+                except Exception as e:
+                    print(f"⚠️ 频道 {cid} 刷新失败: {e}")
+
+                if self._state.get(cid) != RUNNING_DIRTY:
+                    break
+                # 运行期间有新请求：再执行一次
+                self._state[cid] = RUNNING
+                channel = self._latest.pop(cid, channel)
+        finally:
+            self._state.pop(cid, None)
+            self._latest.pop(cid, None)
+        return True
+
+
+class RefreshWorkerPool:
+    """全局刷新工作池：固定数量的 worker + 全局令牌桶。
+
+    同一频道排队期间的重复提交会被合并；排队长度和等待时间可以随时查看。
+    """
+
+    def __init__(self, handler, concurrency=4, bucket=None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self._queue = asyncio.Queue()
+        self._queued = {}    # cid -> (channel, 入队时间)
+        self._workers = []
+        self.active = 0
+        self._waits = deque(maxlen=256)
+        self.stats = {"submitted": 0, "coalesced": 0, "completed": 0, "max_wait": 0.0}
+
+    def submit(self, channel):
+        cid = channel.id
+        self.stats["submitted"] += 1
+        if cid in self._queued:
+            # 已在排队：只更新频道对象
+            self._queued[cid] = (channel, self._queued[cid][1])
+            self.stats["coalesced"] += 1
+            return False
+        self._queued[cid] = (channel, time.monotonic())
+        self._queue.put_nowait(cid)
+        self._ensure_workers()
+        return True
+
+    def _ensure_workers(self):
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            cid = await self._queue.get()
+            entry = self._queued.pop(cid, None)
+            if entry is None:
+                self._queue.task_done()
+                continue
+            channel, queued_at = entry
+            try:
+                if self.bucket:
+                    await self.bucket.acquire()
+                wait = time.monotonic() - queued_at
+                self._waits.append(wait)
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+
+                self.active += 1
+                try:
+                    await self.handler(channel)
+                except Exception as e:
+                    print(f"⚠️ 频道 {cid} 刷新失败: {e}")
+                finally:
+                    self.active -= 1
+                self.stats["completed"] += 1
+            finally:
+                self._queue.task_done()
+
+    def metrics(self):
+        waits = sorted(self._waits)
+        stats = dict(self.stats)
+        stats["depth"] = len(self._queued)
+        stats["active"] = self.active
+        stats["avg_wait"] = sum(waits) / len(waits) if waits else 0.0
+        stats["p95_wait"] = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return stats
@@ -0,0 +1,123 @@
+# render.py
+
+import re
+from collections import OrderedDict
+
+import discord
+
+# ================= 答疑内容渲染 =================
+# 回答文本只解析一次：拆成“正文 + 图片列表”，结果按内容放进 LRU 缓存。
+# 快速答疑同时提取 Markdown 图片和裸图片链接；面板答疑沿用旧规则，只提取 Markdown 图片，
+# 裸链接留在正文中。两种规则各用一个缓存。
+# 缓存直接以字符串本身为键：str 的哈希值会缓存在对象上，命中时无需重新计算。
+
+# Markdown 图片 ![alt](url) 与裸露的图片链接分两个正则扫描：两者都以固定字符开头，
+# 正则引擎可以直接跳到候选位置（合成一个带 IGNORECASE 的正则时每个字符都要尝试，冷解析慢数倍）。
+# 链接协议按小写匹配，只有扩展名不区分大小写。
+_MD_IMAGE_RE = re.compile(r"!\[[^\]]*\]\((https?://[^)\s]+)\)")
+_BARE_IMAGE_RE = re.compile(r"https?://[^\s()<>]+?\.(?i:png|jpe?g|gif|webp)(?:\?[^\s()<>]*)?(?!\w|\.\w)")
+_IMAGE_EXT_RE = re.compile(r"\.(?:png|jpe?g|gif|webp)", re.IGNORECASE)
+
+# 一条消息最多 4 张图（主 Embed 1 张 + 附加 3 张）
+MAX_IMAGES = 4
+CACHE_SIZE = 512
+
+
+class RenderedAnswer:
+    __slots__ = ("text", "images")
+
+    def __init__(self, text, images):
+        self.text = text
+        self.images = images
+
+
+def _parse(content, bare_images=True):
+    """bare_images=False 时只提取 Markdown 图片，裸链接原样留在正文里（面板答疑的旧规则）。"""
+    spans = []      # (起点, 终点, 图片链接)；非图片的 Markdown 图片语法链接为 None，只移除不展示
+    for match in _MD_IMAGE_RE.finditer(content):
+        url = match.group(1)
+        spans.append((match.start(), match.end(), url if _IMAGE_EXT_RE.search(url) else None))
+    if bare_images:
+        md_spans = spans[:]
+        i = 0
+        for match in _BARE_IMAGE_RE.finditer(content):
+            start = match.start()
+            # 跳过 Markdown 图片语法内部的链接
+            while i < len(md_spans) and md_spans[i][1] <= start:
+                i += 1
+            if i < len(md_spans) and md_spans[i][0] <= start:
+                continue
+            spans.append((start, match.end(), match.group()))
+        spans.sort()
+
+    if not spans:
+        return RenderedAnswer(content.strip(), ())
+    images = []
+    parts = []
+    pos = 0
+    for start, end, url in spans:
+        parts.append(content[pos:start])
+        pos = end
+        if url is not None and url not in images:
+            images.append(url)
+    parts.append(content[pos:])
+    return RenderedAnswer("".join(parts).strip(), tuple(images))
+
+
+class RenderCache:
+    def __init__(self, maxsize=CACHE_SIZE, bare_images=True):
+        self.maxsize = maxsize
+        self.bare_images = bare_images
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, content):
+        rendered = self._entries.get(content)
+        if rendered is not None:
+            self._entries.move_to_end(content)
+            self.hits += 1
+            return rendered
+
+        self.misses += 1
+        rendered = _parse(content, self.bare_images)
+        self._entries[content] = rendered
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return rendered
+
+    def invalidate(self, content):
+        if content:
+            self._entries.pop(content, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+cache = RenderCache()
+panel_cache = RenderCache(bare_images=False)
+
+
+def parse(content, bare_images=True):
+    return (cache if bare_images else panel_cache).parse(content or "")
+
+
+def invalidate(content):
+    cache.invalidate(content)
+    panel_cache.invalidate(content)
+
+
+def build_embeds(title, content, color, placeholder, gallery_url=None, bare_images=True):
+    """根据回答内容生成 Embed 列表；gallery_url 相同的 Embed 会被 Discord 合并成图集。"""
+    rendered = parse(content, bare_images)
+    main_embed = discord.Embed(title=title, description=rendered.text or placeholder, color=color)
+    embeds = [main_embed]
+
+    if rendered.images:
+        main_embed.set_image(url=rendered.images[0])
+        for img_url in rendered.images[1:MAX_IMAGES]:
+            extra_embed = discord.Embed(url=gallery_url, color=color)
+            extra_embed.set_image(url=img_url)
+            embeds.append(extra_embed)
+
+    return embeds
@@ -0,0 +1,151 @@
+# roleplan.py
+
+import re
+
+# ================= 身份组集合运算 =================
+# 条件表达式在“成员持有的身份组 id 集合”上求值，语法：
+#   A | B   并集（拥有 A 或 B）
+#   A & B   交集（同时拥有 A 和 B）
+#   A - B   差集（拥有 A 但没有 B）
+#   ( )     分组；| 和 - 同级、从左到右结合，& 优先级更高
+# 身份组可以写成 @提及、数字 id 或（不含空格和运算符的）名称。
+# 例：“(A | B) - C” 表示在 A 或 B 中、但不在 C 中的成员。
+
+_TOKEN_RE = re.compile(r"\s*(?:<@&(\d+)>|([()|&\-])|([^\s()|&\-]+))")
+
+
+class PlanError(ValueError):
+    pass
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise PlanError(f"无法解析: {text[pos:]}")
+        mention, op, word = match.groups()
+        if mention:
+            tokens.append(("role", mention))
+        elif op:
+            tokens.append(("op", op))
+        else:
+            tokens.append(("role", word))
+        pos = match.end()
+    return tokens
+
+
+class Expr:
+    """编译后的条件：可以对成员的身份组 id 集合求值。"""
+
+    __slots__ = ("op", "left", "right", "role_id")
+
+    def __init__(self, op, left=None, right=None, role_id=None):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.role_id = role_id
+
+    def matches(self, role_ids):
+        if self.op == "role":
+            return self.role_id in role_ids
+        if self.op == "|":
+            return self.left.matches(role_ids) or self.right.matches(role_ids)
+        if self.op == "&":
+            return self.left.matches(role_ids) and self.right.matches(role_ids)
+        return self.left.matches(role_ids) and not self.right.matches(role_ids)
+
+    def role_ids(self):
+        if self.op == "role":
+            return {self.role_id}
+        return self.left.role_ids() | self.right.role_ids()
+
+    def __str__(self):
+        if self.op == "role":
+            return f"<@&{self.role_id}>"
+        return f"({self.left} {self.op} {self.right})"
+
+
+def parse_expression(text, resolve):
+    """解析条件表达式。resolve(名称或 id) 返回身份组 id，找不到时返回 None。"""
+    tokens = _tokenize(text)
+    if not tokens:
+        raise PlanError("条件不能为空")
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def atom():
+        nonlocal pos
+        kind, value = peek()
+        if kind == "role":
+            pos += 1
+            role_id = resolve(value)
+            if role_id is None:
+                raise PlanError(f"找不到身份组: {value}")
+            return Expr("role", role_id=role_id)
+        if value == "(":
+            pos += 1
+            node = expr()
+            if peek()[1] != ")":
+                raise PlanError("括号不匹配")
+            pos += 1
+            return node
+        raise PlanError(f"此处需要身份组: {value or '表达式结尾'}")
+
+    def term():
+        nonlocal pos
+        node = atom()
+        while peek()[1] == "&":
+            pos += 1
+            node = Expr("&", node, atom())
+        return node
+
+    def expr():
+        nonlocal pos
+        node = term()
+        while peek()[1] in ("|", "-"):
+            op = peek()[1]
+            pos += 1
+            node = Expr(op, node, term())
+        return node
+
+    node = expr()
+    if pos != len(tokens):
+        raise PlanError(f"多余的内容: {tokens[pos][1]}")
+    return node
+
+
+class RolePlan:
+    """对符合条件的成员：最终身份组 = (当前 ∪ 添加) − 移除，一次编辑完成。"""
+
+    def __init__(self, selector, add=(), remove=()):
+        self.selector = selector
+        self.add = frozenset(add)
+        self.remove = frozenset(remove)
+
+    def final_roles(self, role_ids):
+        """返回成员需要变成的身份组集合；不需要改动时返回 None。"""
+        if not self.selector.matches(role_ids):
+            return None
+        final = (role_ids | self.add) - self.remove
+        if final == role_ids:
+            return None
+        return final
+
+    def dry_run(self, members):
+        """统计：符合条件人数、需要改动人数、新增/移除的身份组次数。"""
+        stats = {"matched": 0, "changed": 0, "added": 0, "removed": 0}
+        for role_ids in members:
+            if not self.selector.matches(role_ids):
+                continue
+            stats["matched"] += 1
+            final = (role_ids | self.add) - self.remove
+            if final != role_ids:
+                stats["changed"] += 1
+                stats["added"] += len(final - role_ids)
+                stats["removed"] += len(role_ids - final)
+        return stats
@@ -0,0 +1,336 @@
+# search.py
+
+import asyncio
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter, OrderedDict, defaultdict
+from itertools import islice
+
+# ================= 标题搜索 =================
+# 字符 n-gram 倒排索引（对中文同样有效）：单字查询走单字索引，其余走二元组索引。
+# 排序：前缀匹配 > 子串匹配 > 模糊匹配。
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class TitleIndex:
+    FUZZY_MIN_RATIO = 0.5
+    CACHE_SIZE = 256
+
+    def __init__(self, titles=()):
+        self.rebuild(titles)
+
+    def rebuild(self, titles):
+        self._lower = {}                 # title -> 小写标题
+        self._order = {}                 # title -> 插入顺序
+        self._seq = 0
+        self._chars = defaultdict(set)
+        self._grams = defaultdict(set)
+        self._cache = OrderedDict()      # 查询 -> 子串命中的完整排序结果
+        for title in titles:
+            self.add(title)
+
+    def add(self, title):
+        if title in self._lower:
+            return
+        lower = title.lower()
+        self._lower[title] = lower
+        self._order[title] = self._seq
+        self._seq += 1
+        for ch in set(lower):
+            self._chars[ch].add(title)
+        for gram in _bigrams(lower):
+            self._grams[gram].add(title)
+        self._cache.clear()
+
+    def remove(self, title):
+        lower = self._lower.pop(title, None)
+        if lower is None:
+            return
+        del self._order[title]
+        for ch in set(lower):
+            self._discard(self._chars, ch, title)
+        for gram in _bigrams(lower):
+            self._discard(self._grams, gram, title)
+        self._cache.clear()
+
+    def rename(self, old_title, new_title):
+        self.remove(old_title)
+        self.add(new_title)
+
+    @staticmethod
+    def _discard(postings, key, title):
+        bucket = postings.get(key)
+        if bucket is not None:
+            bucket.discard(title)
+            if not bucket:
+                del postings[key]
+
+    def __len__(self):
+        return len(self._lower)
+
+    def _candidates(self, query):
+        if len(query) == 1:
+            return self._chars.get(query, set())
+        postings = [self._grams.get(gram) for gram in _bigrams(query)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        result = set(postings[0])
+        for bucket in postings[1:]:
+            result &= bucket
+            if not result:
+                break
+        return result
+
+    def _substring_matches(self, query):
+        cached = self._cache.get(query)
+        if cached is not None:
+            self._cache.move_to_end(query)
+            return cached
+
+        # 用户逐字输入时，之前某个前缀的结果一定包含当前结果，直接在其中过滤
+        pool = None
+        for end in range(len(query) - 1, 0, -1):
+            prefix_hit = self._cache.get(query[:end])
+            if prefix_hit is not None:
+                pool = prefix_hit
+                break
+        if pool is None:
+            pool = self._candidates(query)
+
+        prefix, substring = [], []
+        for title in pool:
+            lower = self._lower[title]
+            if lower.startswith(query):
+                prefix.append(title)
+            elif query in lower:
+                substring.append(title)
+
+        prefix.sort(key=lambda t: (len(t), self._order[t]))
+        substring.sort(key=lambda t: (self._lower[t].find(query), self._order[t]))
+        result = tuple(prefix + substring)
+
+        self._cache[query] = result
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return result
+
+    def _fuzzy_matches(self, query, exclude, limit):
+        grams = _bigrams(query)
+        if len(grams) < 2:
+            return []
+        scores = Counter()
+        for gram in grams:
+            for title in self._grams.get(gram, ()):
+                scores[title] += 1
+        threshold = len(grams) * self.FUZZY_MIN_RATIO
+        ranked = sorted(
+            (t for t, n in scores.items() if n >= threshold and t not in exclude),
+            key=lambda t: (-scores[t], self._order[t]),
+        )
+        return ranked[:limit]
+
+    def search(self, query, limit=25):
+        query = query.strip().lower()
+        if not query:
+            return list(islice(self._lower, limit))
+
+        hits = list(self._substring_matches(query)[:limit])
+        if len(hits) < limit:
+            hits.extend(self._fuzzy_matches(query, set(hits), limit - len(hits)))
+        return hits
+
+
+# ================= 全文检索 (BM25) =================
+# 中文按连续字符的二元组切分，英文/数字按单词切分；标题权重为正文的两倍。
+
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_TOKEN_RE = re.compile(rf"[{_CJK_RANGES}]+|[a-z0-9]+")
+_CJK_RE = re.compile(rf"[{_CJK_RANGES}]")
+
+
+def tokenize(text):
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _digest(title, text):
+    # 加密摘要：碰撞概率可忽略，内容改了就一定会重新切词（内置 hash() 做不到这一点）
+    h = hashlib.blake2b(digest_size=16)
+    h.update(title.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.digest()
+
+
+class FullTextIndex:
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        self._postings = defaultdict(dict)   # term -> {doc_id: tf}
+        # doc_id -> (内容摘要, 词项列表, 长度, 展示信息, 分组)；只存摘要，不常驻正文
+        self._docs = {}
+        self._groups = defaultdict(set)      # 分组 -> {doc_id}，例如某个频道的全部条目
+        self._total_len = 0
+        self._sources = {}
+        self.built = False
+        # 后台建立索引期间收到的增量更新：[(方法, 参数)]，建完后按顺序补上；None 表示不在建立中
+        self._queued = None
+        self._build_task = None
+
+    @property
+    def building(self):
+        return self._queued is not None
+
+    def register_source(self, name, loader):
+        """loader() 返回 [(分组, doc_id, 标题, 正文, 展示信息)]，首次检索前统一加载。"""
+        self._sources[name] = loader
+
+    def ensure_built(self):
+        if self.built:
+            return
+        self.built = True
+        for loader in self._sources.values():
+            for group, doc_id, title, text, meta in loader():
+                self.add(group, doc_id, title, text, meta)
+
+    async def build_in_background(self):
+        """在事件循环里取出全部文档，切词放到线程里做，完成后替换当前（空的）索引。
+
+        建立中再次调用会等待同一次建立完成；调用方被取消（如 wait_for 超时）不会中断建立。
+        """
+        if self.built:
+            return
+        if self._build_task is None:
+            # 数据源读取的是事件循环上的实时数据，必须在这里一次性取完
+            docs = [doc for loader in self._sources.values() for doc in loader()]
+            self._queued = []
+            self._build_task = asyncio.create_task(self._build(docs))
+        await asyncio.shield(self._build_task)
+
+    async def _build(self, docs):
+        try:
+            fresh = await asyncio.to_thread(self._build_from, docs)
+        except Exception:
+            self._queued = None
+            raise
+        finally:
+            self._build_task = None
+        self._postings = fresh._postings
+        self._docs = fresh._docs
+        self._groups = fresh._groups
+        self._total_len = fresh._total_len
+        self.built = True
+        queued, self._queued = self._queued, None
+        for method, args in queued:
+            method(*args)
+
+    @staticmethod
+    def _build_from(docs):
+        index = FullTextIndex()
+        index.built = True
+        for group, doc_id, title, text, meta in docs:
+            index.add(group, doc_id, title, text, meta)
+        return index
+
+    def add(self, group, doc_id, title, text, meta=None):
+        if self.building:
+            self._queued.append((self.add, (group, doc_id, title, text, meta)))
+            return
+        if not self.built:
+            # 尚未建立索引时跳过，建立时会从数据源完整加载
+            return
+        digest = _digest(title, text)
+        old = self._docs.get(doc_id)
+        if old is not None and old[0] == digest and old[4] == group:
+            self._docs[doc_id] = (digest, old[1], old[2], meta, group)
+            return
+        self.remove(doc_id)
+
+        terms = tokenize(title) * 2 + tokenize(text)
+        tf = Counter(terms)
+        for term, n in tf.items():
+            self._postings[term][doc_id] = n
+        self._docs[doc_id] = (digest, tuple(tf), len(terms), meta, group)
+        self._groups[group].add(doc_id)
+        self._total_len += len(terms)
+
+    def remove(self, doc_id):
+        if self.building:
+            self._queued.append((self.remove, (doc_id,)))
+            return
+        old = self._docs.pop(doc_id, None)
+        if old is None:
+            return
+        for term in old[1]:
+            bucket = self._postings.get(term)
+            if bucket is not None:
+                bucket.pop(doc_id, None)
+                if not bucket:
+                    del self._postings[term]
+        self._total_len -= old[2]
+        members = self._groups.get(old[4])
+        if members is not None:
+            members.discard(doc_id)
+            if not members:
+                del self._groups[old[4]]
+
+    def replace_group(self, group, docs):
+        """用 [(doc_id, 标题, 正文, 展示信息)] 替换整个分组，未变化的条目不会重新切词。"""
+        if self.building:
+            self._queued.append((self.replace_group, (group, list(docs))))
+            return
+        if not self.built:
+            return
+        keep = set()
+        for doc_id, title, text, meta in docs:
+            self.add(group, doc_id, title, text, meta)
+            keep.add(doc_id)
+        for doc_id in self._groups.get(group, set()) - keep:
+            self.remove(doc_id)
+
+    def search(self, query, limit=10, accept=None):
+        """返回得分最高的 limit 条；accept(doc_id, 展示信息) 为假的文档在排名前就被排除。"""
+        if self.building:
+            # 后台建立中，切词线程正在使用数据，这里不能同步重建
+            return []
+        self.ensure_built()
+        terms = set(tokenize(query))
+        if not terms or not self._docs:
+            return []
+
+        n_docs = len(self._docs)
+        avg_len = self._total_len / n_docs
+        scores = defaultdict(float)
+        for term in terms:
+            bucket = self._postings.get(term)
+            if not bucket:
+                continue
+            idf = math.log(1 + (n_docs - len(bucket) + 0.5) / (len(bucket) + 0.5))
+            for doc_id, tf in bucket.items():
+                doc_len = self._docs[doc_id][2]
+                norm = tf + self.K1 * (1 - self.B + self.B * doc_len / avg_len)
+                scores[doc_id] += idf * tf * (self.K1 + 1) / norm
+
+        items = scores.items()
+        if accept is not None:
+            items = (item for item in items if accept(item[0], self._docs[item[0]][3]))
+        top = heapq.nlargest(limit, items, key=lambda item: item[1])
+        return [(doc_id, score, self._docs[doc_id][3]) for doc_id, score in top]
+
+
+fulltext = FullTextIndex()
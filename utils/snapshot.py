@@ -0,0 +1,63 @@
+# snapshot.py
+
+from collections.abc import Mapping
+from types import MappingProxyType
+
+# ================= 只读配置快照 =================
+# 读者共享同一个冻结对象；写者基于快照生成新字典，再交给 DataManager 生成新版本。
+
+
+def freeze(value):
+    if isinstance(value, MappingProxyType):
+        # 已冻结的部分直接复用
+        return value
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        frozen = tuple(freeze(v) for v in value)
+        if isinstance(value, tuple) and all(a is b for a, b in zip(frozen, value)):
+            # 未变化的元组原样保留，便于用 is 判断内容是否改动
+            return value
+        return frozen
+    return value
+
+
+def thaw(value):
+    """把快照（或其中的任意部分）还原为普通的 dict / list。"""
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+class ConfigSnapshot(Mapping):
+    __slots__ = ("_data", "version")
+
+    def __init__(self, config, version):
+        data = {k: freeze(v) for k, v in config.items()}
+        data.setdefault("qa_list", ())
+        data.setdefault("sub_role_ids", ())
+        self._data = data
+        self.version = version
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"<ConfigSnapshot v{self.version} {self._data!r}>"
+
+    def to_dict(self):
+        return thaw(self._data)
+
+    def evolve(self, **changes):
+        """返回应用了修改的新配置字典（未修改的部分与当前快照共享）。"""
+        data = dict(self._data)
+        data.update(changes)
+        return data
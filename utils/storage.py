@@ -0,0 +1,208 @@
+# storage.py
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+# ================= 存储后端 =================
+# 后端只负责“把频道配置落盘”，统一接口：
+#   load()                     -> {channel_id: config}
+#   commit(channels, changed)  -> changed 为发生变化的频道 ID 集合，None 表示全部
+#   close()
+# 频道配置可能是只读快照（Mapping / tuple），序列化时统一转为普通 JSON。
+
+
+def _json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class JsonStorage:
+    """旧版 data.json 存储：每次提交都整份重写（临时文件 + 原子替换）。"""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not isinstance(data.get("channels"), dict):
+            return {}
+        return data["channels"]
+
+    def commit(self, channels, changed=None):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"channels": channels}, f, ensure_ascii=False, indent=4, default=_json_default)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """SQLite (WAL) 存储：一行一个频道，一行一条答疑，只写变化的部分。"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            config     TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS qa_entries (
+            channel_id TEXT    NOT NULL,
+            position   INTEGER NOT NULL,
+            q          TEXT    NOT NULL,
+            a          TEXT    NOT NULL,
+            entry_id   TEXT    NOT NULL DEFAULT '',
+            PRIMARY KEY (channel_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path, legacy_json=None, synchronous="NORMAL"):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.executescript(self.SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(qa_entries)")}
+        if "entry_id" not in columns:
+            # 早期数据库没有条目 id 列，加载后由上层补齐 id 再写回
+            self._conn.execute("ALTER TABLE qa_entries ADD COLUMN entry_id TEXT NOT NULL DEFAULT ''")
+        # 已落盘内容的镜像：{cid: (频道 JSON, [(id, q, a), ...])}，用于计算增量
+        self._written = {}
+
+    @staticmethod
+    def _split(config):
+        meta = {k: v for k, v in config.items() if k != "qa_list"}
+        meta_json = json.dumps(meta, ensure_ascii=False, sort_keys=True, default=_json_default)
+        rows = [
+            (str(item.get("id") or ""), str(item.get("q", "")), str(item.get("a", "")))
+            for item in config.get("qa_list") or []
+        ]
+        return meta_json, rows
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load(self):
+        channels = {}
+        for cid, config_json in self._conn.execute("SELECT channel_id, config FROM channels"):
+            try:
+                config = json.loads(config_json)
+            except json.JSONDecodeError:
+                config = {}
+            config["qa_list"] = []
+            channels[cid] = config
+
+        for cid, entry_id, q, a in self._conn.execute(
+            "SELECT channel_id, entry_id, q, a FROM qa_entries ORDER BY channel_id, position"
+        ):
+            if cid in channels:
+                item = {"id": entry_id, "q": q, "a": a} if entry_id else {"q": q, "a": a}
+                channels[cid]["qa_list"].append(item)
+
+        self._written = {cid: self._split(cfg) for cid, cfg in channels.items()}
+
+        # 首次启动：一次性导入旧的 data.json
+        if not channels and self.get_meta("legacy_json_imported") is None:
+            legacy = self._load_legacy()
+            if legacy:
+                self.commit(legacy)
+                channels = legacy
+                print(f"📦 已从 {self.legacy_json} 导入 {len(legacy)} 个频道配置到 {self.path}")
+            self.set_meta("legacy_json_imported", "1")
+
+        return channels
+
+    def _load_legacy(self):
+        if not self.legacy_json or not os.path.exists(self.legacy_json):
+            return {}
+        try:
+            return JsonStorage(self.legacy_json).load()
+        except Exception as e:
+            print(f"⚠️ 旧版 {self.legacy_json} 读取失败，跳过导入: {e}")
+            return {}
+
+    def commit(self, channels, changed=None):
+        if changed is None:
+            changed = set(channels) | set(self._written)
+
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                for cid in changed:
+                    cid = str(cid)
+                    config = channels.get(cid)
+                    if config is None:
+                        cur.execute("DELETE FROM channels WHERE channel_id = ?", (cid,))
+                        cur.execute("DELETE FROM qa_entries WHERE channel_id = ?", (cid,))
+                        self._written.pop(cid, None)
+                        continue
+
+                    meta_json, rows = self._split(config)
+                    if cid not in self._written:
+                        # 镜像中没有记录：先清空该频道的旧条目，避免残留
+                        cur.execute("DELETE FROM qa_entries WHERE channel_id = ?", (cid,))
+                    old_meta, old_rows = self._written.get(cid, (None, []))
+
+                    if meta_json != old_meta:
+                        cur.execute(
+                            "INSERT OR REPLACE INTO channels (channel_id, config) VALUES (?, ?)",
+                            (cid, meta_json),
+                        )
+
+                    for pos, row in enumerate(rows):
+                        if pos >= len(old_rows) or old_rows[pos] != row:
+                            cur.execute(
+                                "INSERT OR REPLACE INTO qa_entries (channel_id, position, entry_id, q, a) VALUES (?, ?, ?, ?, ?)",
+                                (cid, pos, *row),
+                            )
+                    if len(old_rows) > len(rows):
+                        cur.execute(
+                            "DELETE FROM qa_entries WHERE channel_id = ? AND position >= ?",
+                            (cid, len(rows)),
+                        )
+
+                    self._written[cid] = (meta_json, rows)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                # 回滚后这些频道的镜像不再可信，下次提交时整体重写
+                for cid in changed:
+                    self._written.pop(str(cid), None)
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_storage(backend, json_path, sqlite_path, durable=False):
+    # durable=True：每次落盘都 fsync / synchronous=FULL，更安全但更慢
+    if backend == "json":
+        return JsonStorage(json_path, fsync=durable)
+    if backend == "sqlite":
+        return SqliteStorage(sqlite_path, legacy_json=json_path, synchronous="FULL" if durable else "NORMAL")
+    raise ValueError(f"未知的存储后端: {backend}")